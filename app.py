@@ -5,6 +5,10 @@ import re
 from joblib import Parallel, delayed
 import time
 
+from company_search import SEARCH_LIMIT, CompanySearch
+from registry import CompanyIndex, category_options, merge_sources
+from snapshot_cache import read_source
+
 
 def calculate_visa_number_score(visa_approved, visa_cancelled):
     visa_number = visa_approved + visa_cancelled
@@ -208,17 +212,45 @@ def calculate_wps_score(wps_status):
     return 0
 
 
-# Load only required columns from the Excel and CSV files
-df_org = pd.read_excel('./data/appro-companies.xlsx',
-                       usecols=['business_name_english', 'economic_department', 'status', 'legal_type', 'wps',
-                                'est_date', 'expiry_date', 'visa_approved', 'visa_cancelled', 'visa_requested',
-                                'visa_used', 'phone_no', 'mobile_no', 'website_url', 'email', 'is_branch'],
-                       engine='openpyxl')
-df_extended = pd.read_csv('./data/3k_extended.csv',
-                          usecols=['business_name_english', 'economic_department', 'status', 'legal_type', 'wps',
-                                   'est_date', 'expiry_date', 'visa_approved', 'visa_cancelled', 'visa_requested',
-                                   'visa_used', 'phone_no', 'mobile_no', 'website_url', 'email', 'is_branch'])
-df = pd.concat([df_org, df_extended], ignore_index=True)
+# Sidebar selectboxes offering a column's distinct values
+CATEGORY_COLUMNS = ['economic_department', 'status', 'legal_type', 'wps', 'is_branch']
+
+# Load only required columns from the Excel and CSV files, once per process
+@st.cache_data
+def load_data():
+    df_org = read_source('./data/appro-companies.xlsx',
+                         columns=['company_id', 'bl_local_no', 'business_name_english', 'economic_department', 'status',
+                                  'legal_type', 'wps', 'est_date', 'expiry_date', 'visa_approved', 'visa_cancelled',
+                                  'visa_requested', 'visa_used', 'phone_no', 'mobile_no', 'website_url', 'email',
+                                  'is_branch'])
+    df_extended = read_source('./data/3k_extended.csv',
+                              columns=['company_id', 'bl_local_no', 'business_name_english', 'economic_department',
+                                       'status', 'legal_type', 'wps', 'est_date', 'expiry_date', 'visa_approved',
+                                       'visa_cancelled', 'visa_requested', 'visa_used', 'phone_no', 'mobile_no',
+                                       'website_url', 'email', 'is_branch'])
+    return merge_sources({'appro-companies.xlsx': df_org, '3k_extended.csv': df_extended}, ignore_index=True)
+
+
+# Company key -> row position and display labels, built once per process and shared by every session
+@st.cache_resource
+def load_company_index():
+    return CompanyIndex(load_data())
+
+# Word-prefix search over names and licence numbers, built once per process
+@st.cache_resource
+def load_company_search():
+    return CompanySearch(load_data())
+
+# Options and value -> index dicts of the category selectboxes, shared by every session
+@st.cache_resource
+def load_category_options():
+    return category_options(load_data(), CATEGORY_COLUMNS)
+
+
+df = load_data()
+company_index = load_company_index()
+company_search = load_company_search()
+sidebar_options = load_category_options()
 
 
 def calculate_risk_score(row, weights):
@@ -246,16 +278,33 @@ def calculate_risk_score(row, weights):
 st.title("Company Risk Score Calculator")
 
 # User selects features for the company
-selected_company_name = st.selectbox("Select business_name_english:", df['business_name_english'].unique())
+# Only the best matches of the search are offered, and the selection is kept by company key
+search_query = st.text_input("Search Company:", placeholder="Name or licence number")
+selected = company_index.position(st.session_state.get('selected_key'))
+if selected is None:
+    # Companies without ids are kept by position
+    selected = st.session_state.get('selected_position', 0)
+if search_query:
+    matches = company_search.search(search_query, SEARCH_LIMIT)
+else:
+    # The selected company stays on offer when the search is cleared
+    matches = [selected] + [position for position in range(min(SEARCH_LIMIT, len(company_index)))
+                            if position != selected][:SEARCH_LIMIT - 1]
+if not matches:
+    st.warning(f"No company matches '{search_query}'.")
+    matches = [selected]
+selected_position = st.selectbox("Select business_name_english:", matches, format_func=company_index.label)
+st.session_state['selected_key'] = company_index.key(selected_position)
+st.session_state['selected_position'] = selected_position
 
 # Populate features based on selected company
-selected_company = df[df['business_name_english'] == selected_company_name].iloc[0]
+selected_company = df.iloc[selected_position]
 
 # User inputs and modifications for the selected company features
 features = {}
-for column in ['economic_department', 'status', 'legal_type', 'wps', 'is_branch']:
-    features[column] = st.selectbox(f"{column}:", df[column].unique(),
-                                    index=df[column].tolist().index(selected_company[column]))
+for column in CATEGORY_COLUMNS:
+    options, option_index = sidebar_options[column]
+    features[column] = st.selectbox(f"{column}:", options, index=option_index.get(selected_company[column], 0))
 
 for column in ['visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used']:
     features[column] = st.number_input(f"Enter {column}:", value=int(selected_company[column]))
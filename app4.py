@@ -4,6 +4,16 @@ import numpy as np
 import re
 from datetime import datetime
 
+from factor_timing import is_enabled as factor_timing_enabled, reset as reset_factor_timing, time_factor, \
+    timing_summary
+from company_search import SEARCH_LIMIT, CompanySearch
+from portfolio import PAGE_SIZES, SORT_COLUMNS, category_codes, filter_positions, name_ranks, page_frame, \
+    page_positions, sort_keys
+from risk_engine import DEFAULT_WEIGHTS, FACTORS, factor_matrix, apply_weights
+from registry import CompanyIndex, category_options, merge_sources
+from scoring_jobs import UPLOAD_TYPES, ScoringJob
+from snapshot_cache import read_source, source_version
+
 
 # Include risk calculation functions here
 def calculate_economic_zone_score(economic_zone):
@@ -210,24 +220,25 @@ def calculate_branch_score(is_branch):
 
 def calculate_risk_scores(features, weights):
     scores = {}
-    scores['Economic Zone'] = calculate_economic_zone_score(features['economic_department']) * weights[
-        'Economic Zone']
-    scores['Date of Operations'] = calculate_date_of_operations_score(features['est_date'],
-                                                                      features['expiry_date']) * weights[
+    scores['Economic Zone'] = time_factor('Economic Zone', calculate_economic_zone_score,
+                                          features['economic_department']) * weights['Economic Zone']
+    scores['Date of Operations'] = time_factor('Date of Operations', calculate_date_of_operations_score,
+                                               features['est_date'], features['expiry_date']) * weights[
                                        'Date of Operations']
-    scores['Status'] = calculate_status_score(features['status']) * weights['Status']
-    scores['Legal Type'] = calculate_legal_type_score(features['legal_type']) * weights['Legal Type']
-    scores['WPS'] = calculate_wps_score(features['wps']) * weights['WPS']
-    scores['Visa Number'] = calculate_visa_number_score(features['visa_approved'], features['visa_cancelled']) * \
-                            weights['Visa Number']
-    scores['Visa Ratio'] = calculate_visa_ratio_score(features['visa_approved'], features['visa_cancelled'],
-                                                      features['visa_requested'], features['visa_used']) * weights[
-                               'Visa Ratio']
+    scores['Status'] = time_factor('Status', calculate_status_score, features['status']) * weights['Status']
+    scores['Legal Type'] = time_factor('Legal Type', calculate_legal_type_score,
+                                       features['legal_type']) * weights['Legal Type']
+    scores['WPS'] = time_factor('WPS', calculate_wps_score, features['wps']) * weights['WPS']
+    scores['Visa Number'] = time_factor('Visa Number', calculate_visa_number_score, features['visa_approved'],
+                                        features['visa_cancelled']) * weights['Visa Number']
+    scores['Visa Ratio'] = time_factor('Visa Ratio', calculate_visa_ratio_score, features['visa_approved'],
+                                       features['visa_cancelled'], features['visa_requested'],
+                                       features['visa_used']) * weights['Visa Ratio']
     phone_number = features['phone_no'] if pd.notnull(features['phone_no']) else features['mobile_no']
-    scores['Phone'] = calculate_phone_score(phone_number) * weights['Phone']
-    scores['Website'] = calculate_website_score(features['website_url']) * weights['Website']
-    scores['Email'] = calculate_email_score(features['email']) * weights['Email']
-    scores['Branch'] = calculate_branch_score(features['is_branch']) * weights['Branch']
+    scores['Phone'] = time_factor('Phone', calculate_phone_score, phone_number) * weights['Phone']
+    scores['Website'] = time_factor('Website', calculate_website_score, features['website_url']) * weights['Website']
+    scores['Email'] = time_factor('Email', calculate_email_score, features['email']) * weights['Email']
+    scores['Branch'] = time_factor('Branch', calculate_branch_score, features['is_branch']) * weights['Branch']
     scores['Total'] = sum(scores.values())
     return scores
 
@@ -423,109 +434,233 @@ st.markdown("<h1 class='main-header'>📊 Company Risk Score Calculator</h1>", u
 st.write(
     "This application helps calculate a risk score for companies based on different parameters such as economic zone, legal type, visa status, and more.")
 
-# Load data using cached function
-@st.cache_data
-def load_data():
-    df_org = pd.read_excel('./data/appro-companies.xlsx',
-                           usecols=['business_name_english', 'economic_department', 'status', 'legal_type', 'wps',
-                                    'est_date', 'expiry_date', 'visa_approved', 'visa_cancelled', 'visa_requested',
-                                    'visa_used', 'phone_no', 'mobile_no', 'website_url', 'email', 'is_branch'],
-                           engine='openpyxl')
-    df_extended = pd.read_csv('./data/3k_extended.csv',
-                              usecols=['business_name_english', 'economic_department', 'status', 'legal_type', 'wps',
-                                       'est_date', 'expiry_date', 'visa_approved', 'visa_cancelled', 'visa_requested',
-                                       'visa_used', 'phone_no', 'mobile_no', 'website_url', 'email', 'is_branch'])
-    df = pd.concat([df_org, df_extended], ignore_index=True)
+# Registry sources the app loads
+SOURCES = ['./data/appro-companies.xlsx', './data/3k_extended.csv']
+
+# Sidebar selectboxes offering a column's distinct values
+CATEGORY_COLUMNS = ['economic_department', 'status', 'legal_type', 'wps', 'is_branch']
+
+# Seconds between progress updates of a running upload
+UPLOAD_POLL_SECONDS = 1
+
+
+# Load data using cached function. Every cached loader takes the sources' version, which only
+# keys the cache: when a source file changes, everything is rebuilt once for the new data. The
+# frame is shared by every session and rerun rather than copied out of the cache each time, so
+# nothing may modify it
+@st.cache_resource(max_entries=1)
+def load_data(data_version):
+    df_org = read_source(SOURCES[0],
+                         columns=['company_id', 'bl_local_no', 'business_name_english', 'business_name_arabic',
+                                  'economic_department', 'status', 'legal_type', 'wps', 'est_date', 'expiry_date',
+                                  'visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used', 'phone_no',
+                                  'mobile_no', 'website_url', 'email', 'is_branch'])
+    df_extended = read_source(SOURCES[1],
+                              columns=['company_id', 'bl_local_no', 'business_name_english', 'business_name_arabic',
+                                       'economic_department', 'status', 'legal_type', 'wps', 'est_date', 'expiry_date',
+                                       'visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used', 'phone_no',
+                                       'mobile_no', 'website_url', 'email', 'is_branch'])
+    df = merge_sources({'appro-companies.xlsx': df_org, '3k_extended.csv': df_extended}, ignore_index=True)
     return df
 
+# Company key -> row position and display labels, built once per process and shared by every session
+@st.cache_resource(max_entries=1)
+def load_company_index(data_version):
+    return CompanyIndex(load_data(data_version))
+
+# Word-prefix search over names and licence numbers, built once per process
+@st.cache_resource(max_entries=1)
+def load_company_search(data_version):
+    return CompanySearch(load_data(data_version))
+
+# Raw factor scores for every loaded company, computed once per process; re-weighting
+# them is a single matrix-vector product
+@st.cache_resource(max_entries=1)
+def load_factor_matrix(data_version):
+    return factor_matrix(load_data(data_version).rename(columns={'website_url': 'website'}))
+
+# Options and value -> index dicts of the CATEGORY_COLUMNS selectboxes, shared by every session
+@st.cache_resource(max_entries=1)
+def load_category_options(data_version):
+    return category_options(load_data(data_version), CATEGORY_COLUMNS)
+
+# Sort key of the portfolio's name column and filter codes of its category columns
+@st.cache_resource(max_entries=1)
+def load_name_ranks(data_version):
+    return name_ranks(load_data(data_version))
+
+@st.cache_resource(max_entries=1)
+def load_category_codes(data_version):
+    return category_codes(load_data(data_version), CATEGORY_COLUMNS)
+
+
 # Load data
-df = load_data()
+data_version = source_version(SOURCES)
+df = load_data(data_version)
+company_index = load_company_index(data_version)
+company_search = load_company_search(data_version)
+portfolio_matrix = load_factor_matrix(data_version)
+sidebar_options = load_category_options(data_version)
+portfolio_name_ranks = load_name_ranks(data_version)
+portfolio_codes = load_category_codes(data_version)
+
+# The page is split into fragments that rerun on their own: typing a search only reruns the
+# company selection, editing a feature only redraws the company details, and moving a weight
+# slider only redraws the score panel and the portfolio. Fragments share their inputs through
+# the widgets' session state; picking another company reruns the whole app
+VISA_COLUMNS = ['visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used']
+CONTACT_COLUMNS = ['phone_no', 'mobile_no', 'website_url', 'email']
+FEATURE_COLUMNS = CATEGORY_COLUMNS + VISA_COLUMNS + CONTACT_COLUMNS + ['est_date', 'expiry_date']
+
+# Only set while the whole script runs, so a fragment can tell a full run from its own rerun
+st.session_state['full_run'] = True
+
+
+def current_features():
+    return {column: st.session_state[f'feature_{column}'] for column in FEATURE_COLUMNS}
+
+
+def current_weights():
+    return {factor: st.session_state.get(f'weight_{factor}', DEFAULT_WEIGHTS[factor]) for factor in FACTORS}
+
+
+def redraw_company_details():
+    st.rerun('company_details')
+
+
+def redraw_scores():
+    st.rerun(['score_panel', 'portfolio'])
+
+
+def calculate_selected():
+    st.session_state['scored_features'] = current_features()
+    st.rerun('score_panel')
+
 
 # Sidebar for inputs
 st.sidebar.markdown("<h2 style='color: #000000;'>🔍 Company Selection and Feature Weights</h2>", unsafe_allow_html=True)
 
-# User selects features for the company
-st.sidebar.markdown("<h3 style='color: #000000;'>Select Company</h3>", unsafe_allow_html=True)
-selected_company_name = st.sidebar.selectbox("Business Name:", df['business_name_english'].unique())
+
+def selected_company_position():
+    # The selection is kept by company key, so it names the same company after the sources are
+    # reloaded; companies without ids fall back to their last position
+    position = company_index.position(st.session_state.get('selected_key'))
+    if position is None:
+        position = st.session_state.get('selected_position', 0)
+    return position if position < len(company_index) else 0
+
+
+@st.fragment(key='company_selection')
+def company_selection():
+    st.markdown("<h3 style='color: #000000;'>Select Company</h3>", unsafe_allow_html=True)
+    # Only the best matches of the search are sent to the browser as options
+    search_query = st.text_input("Search Company:", placeholder="English or Arabic name, or licence number")
+    if search_query:
+        matches = company_search.search(search_query, SEARCH_LIMIT)
+    else:
+        # The selected company stays on offer, e.g. after the sources are reloaded
+        selected = selected_company_position()
+        matches = [selected] + [position for position in range(min(SEARCH_LIMIT, len(company_index)))
+                                if position != selected][:SEARCH_LIMIT - 1]
+    if not matches:
+        st.warning(f"No company matches '{search_query}'.")
+        matches = [selected_company_position()]
+    selected_position = st.selectbox("Business Name:", matches, format_func=company_index.label)
+    if selected_position != selected_company_position() or 'selected_key' not in st.session_state:
+        st.session_state['selected_key'] = company_index.key(selected_position)
+        st.session_state['selected_position'] = selected_position
+        # The feature inputs start over from the new company's stored values
+        for column in FEATURE_COLUMNS:
+            st.session_state.pop(f'feature_{column}', None)
+        if not st.session_state['full_run']:
+            st.rerun()
+
+
+with st.sidebar:
+    company_selection()
 
 # Populate features based on selected company
-selected_company = df[df['business_name_english'] == selected_company_name].iloc[0]
-
-# User inputs and modifications for the selected company features
-st.sidebar.markdown("<h3 style='color: #000000;'>Company Details</h3>", unsafe_allow_html=True)
-features = {}
-
-for column in ['economic_department', 'status', 'legal_type', 'wps', 'is_branch']:
-    options = df[column].dropna().unique()
-    default_index = list(options).index(selected_company[column]) if selected_company[column] in options else 0
-    features[column] = st.sidebar.selectbox(
-        f"{column.replace('_', ' ').title()}:",
-        options,
-        index=default_index,
-        help=f"Select the {column.replace('_', ' ')} of the company."
+selected_position = selected_company_position()
+selected_company = df.iloc[selected_position]
+
+
+@st.fragment(key='feature_editor')
+def feature_editor():
+    # User inputs and modifications for the selected company features
+    st.markdown("<h3 style='color: #000000;'>Company Details</h3>", unsafe_allow_html=True)
+    for column in CATEGORY_COLUMNS:
+        options, option_index = sidebar_options[column]
+        default_index = option_index.get(selected_company[column], 0)
+        st.selectbox(
+            f"{column.replace('_', ' ').title()}:",
+            options,
+            index=default_index,
+            key=f'feature_{column}',
+            on_change=redraw_company_details,
+            help=f"Select the {column.replace('_', ' ')} of the company."
+        )
+
+    # Adjusted code for visa number inputs
+    for column in VISA_COLUMNS:
+        st.number_input(
+            f"{column.replace('_', ' ').title()}:",
+            value=int(selected_company[column]) if pd.notnull(selected_company[column]) else 0,
+            min_value=0,
+            step=1,
+            format="%d",
+            key=f'feature_{column}',
+            on_change=redraw_company_details,
+            help=f"Enter the {column.replace('_', ' ')}."
+        )
+
+    for column in CONTACT_COLUMNS:
+        placeholder = f"{column.replace('_', ' ').title()}:"
+        st.text_input(
+            placeholder,
+            value=str(selected_company[column] or ""),
+            key=f'feature_{column}',
+            on_change=redraw_company_details,
+            help=f"Enter the company's {column.replace('_', ' ')}."
+        )
+
+    st.date_input(
+        "Establishment Date:",
+        value=pd.to_datetime(selected_company['est_date']) if pd.notnull(
+            selected_company['est_date']) else datetime.today(),
+        key='feature_est_date',
+        on_change=redraw_company_details,
+        help="Select the establishment date."
     )
-
-# Adjusted code for visa number inputs
-for column in ['visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used']:
-    features[column] = st.sidebar.number_input(
-        f"{column.replace('_', ' ').title()}:",
-        value=int(selected_company[column] or 0),
-        min_value=0,
-        step=1,
-        format="%d",
-        help=f"Enter the {column.replace('_', ' ')}."
+    st.date_input(
+        "Expiry Date:",
+        value=pd.to_datetime(selected_company['expiry_date']) if pd.notnull(
+            selected_company['expiry_date']) else datetime.today(),
+        key='feature_expiry_date',
+        on_change=redraw_company_details,
+        help="Select the expiry date."
     )
 
-for column in ['phone_no', 'mobile_no', 'website_url', 'email']:
-    placeholder = f"{column.replace('_', ' ').title()}:"
-    features[column] = st.sidebar.text_input(
-        placeholder,
-        value=str(selected_company[column] or ""),
-        help=f"Enter the company's {column.replace('_', ' ')}."
-    )
 
-features['est_date'] = st.sidebar.date_input(
-    "Establishment Date:",
-    value=pd.to_datetime(selected_company['est_date']) if pd.notnull(
-        selected_company['est_date']) else datetime.today(),
-    help="Select the establishment date."
-)
-features['expiry_date'] = st.sidebar.date_input(
-    "Expiry Date:",
-    value=pd.to_datetime(selected_company['expiry_date']) if pd.notnull(
-        selected_company['expiry_date']) else datetime.today(),
-    help="Select the expiry date."
-)
+@st.fragment(key='weights_editor')
+def weights_editor():
+    # User selects weights for each feature with default values
+    st.markdown("<h3 style='color: #000000;'>Feature Weights</h3>", unsafe_allow_html=True)
+    for factor in FACTORS:
+        st.slider(f"{factor} Weight:", 0.0, 1.0, DEFAULT_WEIGHTS[factor], key=f'weight_{factor}',
+                  on_change=redraw_scores,
+                  help=f"Adjust the weight for {'Branch status' if factor == 'Branch' else factor}.")
 
-# User selects weights for each feature with default values
-st.sidebar.markdown("<h3 style='color: #000000;'>Feature Weights</h3>", unsafe_allow_html=True)
-weights = {
-    'Economic Zone': st.sidebar.slider("Economic Zone Weight:", 0.0, 1.0, 0.15,
-                                       help="Adjust the weight for Economic Zone."),
-    'Date of Operations': st.sidebar.slider("Date of Operations Weight:", 0.0, 1.0, 0.30,
-                                            help="Adjust the weight for Date of Operations."),
-    'Status': st.sidebar.slider("Status Weight:", 0.0, 1.0, 0.10, help="Adjust the weight for Status."),
-    'Legal Type': st.sidebar.slider("Legal Type Weight:", 0.0, 1.0, 0.10, help="Adjust the weight for Legal Type."),
-    'WPS': st.sidebar.slider("WPS Weight:", 0.0, 1.0, 0.05, help="Adjust the weight for WPS."),
-    'Visa Number': st.sidebar.slider("Visa Number Weight:", 0.0, 1.0, 0.30, help="Adjust the weight for Visa Number."),
-    'Visa Ratio': st.sidebar.slider("Visa Ratio Weight:", 0.0, 1.0, 0.30, help="Adjust the weight for Visa Ratio."),
-    'Phone': st.sidebar.slider("Phone Weight:", 0.0, 1.0, 0.10, help="Adjust the weight for Phone."),
-    'Website': st.sidebar.slider("Website Weight:", 0.0, 1.0, 0.10, help="Adjust the weight for Website."),
-    'Email': st.sidebar.slider("Email Weight:", 0.0, 1.0, 0.10, help="Adjust the weight for Email."),
-    'Branch': st.sidebar.slider("Branch Weight:", 0.0, 1.0, 0.10, help="Adjust the weight for Branch status.")
-}
 
-# Main content layout
-st.markdown("<h2 class='sub-header'>Company Details and Risk Score Calculation</h2>", unsafe_allow_html=True)
+with st.sidebar:
+    feature_editor()
+    weights_editor()
 
-# Create a row with two columns
-col1, col2 = st.columns([2, 1])
 
-with col1:
-    st.markdown("### Selected Company Information")
+@st.fragment(key='company_details')
+def company_details():
     # Use expander to show/hide company details
     with st.expander("View Company Details"):
-        updated_company = pd.DataFrame.from_dict(features, orient='index', columns=['Value'])
+        updated_company = pd.DataFrame.from_dict(current_features(), orient='index', columns=['Value'])
         updated_company.index.rename('Feature', inplace=True)
         updated_company.reset_index(inplace=True)
 
@@ -553,56 +688,191 @@ with col1:
 
         st.write(styled_company.to_html(), unsafe_allow_html=True)
 
-with col2:
-    st.markdown("### Calculate Risk Score")
-    # Place the "Calculate Risk Score" button here to align with "View Company Details"
-    if st.button("Calculate Risk Score"):
-        risk_scores = calculate_risk_scores(features, weights)
-        st.session_state['risk_scores'] = risk_scores
-
-# Now display risk scores
-st.markdown("### Risk Scores")
-
-if 'risk_scores' in st.session_state:
-    risk_scores = st.session_state['risk_scores']
-    # Display total risk score prominently
-    st.metric(label="Total Risk Score", value=f"{risk_scores['Total']:.1f}")
-
-    # Use progress bar to visualize risk score (assuming a max score for normalization)
-    max_score = 100  # Define max score based on your scoring system
-    score_percentage = min(max(risk_scores['Total'] / max_score, 0), 1)
-    st.progress(score_percentage)
-
-    # Convert risk_scores to DataFrame
-    risk_scores_df = pd.DataFrame(list(risk_scores.items()), columns=['Parameter', 'Score'])
-    risk_scores_df = risk_scores_df[risk_scores_df['Parameter'] != 'Total']  # Exclude Total
-
-    # Apply conditional formatting to risk scores
-    def highlight_scores(val):
-        # Convert val to numeric, setting non-numeric values to NaN
-        num_val = pd.to_numeric(val, errors='coerce')
-        if pd.isnull(num_val):
-            color = 'black'  # Default color for NaN or non-numeric values
-        elif num_val > 0:
-            color = 'green'
-        elif num_val < 0:
-            color = 'red'
-        else:
-            color = 'black'  # For zero
-        return f'color: {color}'
-
-    styled_scores = risk_scores_df.style.format({'Score': '{:.1f}'}).applymap(highlight_scores).set_table_styles([
-        {'selector': 'th', 'props': [
-            ('font-size', '18px'),
-            ('text-align', 'left'),
-            ('background-color', '#2A9D8F'),
-            ('color', '#ffffff'),
-            ('padding', '12px')
-        ]},
-        {'selector': 'td', 'props': [('padding', '12px'), ('border-bottom', '1px solid #dddddd')]},
-        {'selector': 'tr:nth-child(even)', 'props': [('background-color', '#f3f3f3')]},
-    ]).set_table_attributes('class="styled-table"')
-
-    st.write(styled_scores.to_html(), unsafe_allow_html=True)
-else:
-    st.write("Click the **Calculate Risk Score** button to see the results.")
+
+@st.fragment(key='score_panel')
+def score_panel():
+    weights = current_weights()
+    # Rerank the whole portfolio under the current weights
+    portfolio_scores = apply_weights(portfolio_matrix, weights)
+    selected_rank = int((portfolio_scores > portfolio_scores[selected_position]).sum()) + 1
+    st.metric(label="Portfolio Rank (stored data)", value=f"{selected_rank} of {len(df)}",
+              help="Rank of the selected company's stored record by total score under the current weights.")
+
+    # Now display risk scores
+    st.markdown("### Risk Scores")
+
+    if 'scored_features' in st.session_state:
+        # Rescored under the current weights, so the panel follows the sliders
+        risk_scores = calculate_risk_scores(st.session_state['scored_features'], weights)
+        # Display total risk score prominently
+        st.metric(label="Total Risk Score", value=f"{risk_scores['Total']:.1f}")
+
+        # Use progress bar to visualize risk score (assuming a max score for normalization)
+        max_score = 100  # Define max score based on your scoring system
+        score_percentage = min(max(risk_scores['Total'] / max_score, 0), 1)
+        st.progress(score_percentage)
+
+        # Convert risk_scores to DataFrame
+        risk_scores_df = pd.DataFrame(list(risk_scores.items()), columns=['Parameter', 'Score'])
+        risk_scores_df = risk_scores_df[risk_scores_df['Parameter'] != 'Total']  # Exclude Total
+
+        # Apply conditional formatting to risk scores
+        def highlight_scores(val):
+            # Convert val to numeric, setting non-numeric values to NaN
+            num_val = pd.to_numeric(val, errors='coerce')
+            if pd.isnull(num_val):
+                color = 'black'  # Default color for NaN or non-numeric values
+            elif num_val > 0:
+                color = 'green'
+            elif num_val < 0:
+                color = 'red'
+            else:
+                color = 'black'  # For zero
+            return f'color: {color}'
+
+        styled_scores = risk_scores_df.style.format({'Score': '{:.1f}'}).applymap(highlight_scores).set_table_styles([
+            {'selector': 'th', 'props': [
+                ('font-size', '18px'),
+                ('text-align', 'left'),
+                ('background-color', '#2A9D8F'),
+                ('color', '#ffffff'),
+                ('padding', '12px')
+            ]},
+            {'selector': 'td', 'props': [('padding', '12px'), ('border-bottom', '1px solid #dddddd')]},
+            {'selector': 'tr:nth-child(even)', 'props': [('background-color', '#f3f3f3')]},
+        ]).set_table_attributes('class="styled-table"')
+
+        st.write(styled_scores.to_html(), unsafe_allow_html=True)
+    else:
+        st.write("Click the **Calculate Risk Score** button to see the results.")
+
+
+# Every loaded company ranked under the current weights. Filtering, sorting and paging happen
+# here on the server, and only the rows of the visible page are sent to the browser
+@st.fragment(key='portfolio')
+def portfolio_panel():
+    weights = current_weights()
+    portfolio_scores = apply_weights(portfolio_matrix, weights)
+
+    st.markdown("<h2 class='sub-header'>Portfolio Ranking</h2>", unsafe_allow_html=True)
+    filter_columns = st.columns(4)
+    portfolio_query = filter_columns[0].text_input("Filter by Name or Licence:", key='portfolio_query')
+    code_filters = []
+    for column, filter_column in zip(['economic_department', 'status', 'legal_type'], filter_columns[1:]):
+        options, option_index = sidebar_options[column]
+        selected = filter_column.multiselect(f"{column.replace('_', ' ').title()}:", options,
+                                             key=f'portfolio_{column}')
+        if selected:
+            code_filters.append((portfolio_codes[column], [option_index[value] for value in selected]))
+
+    sort_columns = st.columns(4)
+    sort_column = sort_columns[0].selectbox("Sort By:", SORT_COLUMNS, key='portfolio_sort')
+    descending = sort_columns[1].radio("Order:", ['Descending', 'Ascending'], horizontal=True,
+                                       key='portfolio_order') == 'Descending'
+    min_total = sort_columns[2].number_input("Minimum Total:", value=None, step=1.0, key='portfolio_min_total',
+                                             help="Only show companies with at least this total score.")
+    page_size = sort_columns[3].selectbox("Rows per Page:", PAGE_SIZES, index=1, key='portfolio_page_size')
+
+    search_matches = company_search.search(portfolio_query, len(df)) if portfolio_query.strip() else None
+    positions = filter_positions(len(df), portfolio_scores, min_total, code_filters, search_matches)
+    n_pages = max(1, -(-len(positions) // page_size))
+    # Back to the first page whenever the filters or the order change
+    view = (portfolio_query, [allowed for _, allowed in code_filters], sort_column, descending, min_total, page_size)
+    if st.session_state.get('portfolio_view') != view or st.session_state.get('portfolio_page', 1) > n_pages:
+        st.session_state['portfolio_page'] = 1
+    st.session_state['portfolio_view'] = view
+    page = st.number_input(f"Page (of {n_pages}):", min_value=1, max_value=n_pages, step=1, key='portfolio_page')
+
+    keys = sort_keys(portfolio_matrix, weights, portfolio_scores, portfolio_name_ranks, sort_column)
+    page_rows = page_positions(keys, positions, page - 1, page_size, descending)
+    st.caption(f"{len(positions):,} of {len(df):,} companies match the filters.")
+    st.dataframe(page_frame(df, portfolio_matrix, weights, portfolio_scores, page_rows, (page - 1) * page_size + 1),
+                 hide_index=True,
+                 column_config={column: st.column_config.NumberColumn(format="%.1f")
+                                for column in ['Total'] + FACTORS})
+
+
+def show_upload_job(job):
+    rows, total_rows, elapsed = job.progress
+    st.markdown(f"**{job.name}**: {job.state}")
+    if total_rows:
+        st.progress(min(rows / total_rows, 1.0), text=f"{rows:,} of {total_rows:,} rows scored")
+    metric_columns = st.columns(3)
+    metric_columns[0].metric("Rows Scored", f"{rows:,}")
+    metric_columns[1].metric("Throughput", f"{rows / elapsed if elapsed else 0:,.0f} rows/s")
+    metric_columns[2].metric("Elapsed", f"{elapsed:.1f} s")
+    if job.active:
+        st.button("Cancel Scoring", on_click=job.cancel)
+    elif job.state == 'failed':
+        st.error(f"Scoring '{job.name}' failed: {job.error}")
+    elif job.state == 'expired':
+        st.info(f"The scored file has expired; upload '{job.name}' again to rescore it.")
+    elif job.state == 'done':
+        # The file is only read when the button is clicked, and clicking it does not rerun the app
+        st.download_button("Download Scored File", job.result, file_name=job.result_name, mime='text/csv',
+                           on_click='ignore')
+
+
+# Polls a running job; once it has finished the app reruns once to stop polling
+@st.fragment(run_every=UPLOAD_POLL_SECONDS)
+def upload_progress(job):
+    show_upload_job(job)
+    if not job.active:
+        st.rerun()
+
+
+# Registry files scored in the background with the current weights, see scoring_jobs
+@st.fragment(key='upload')
+def upload_panel():
+    st.markdown("<h2 class='sub-header'>Score a Registry File</h2>", unsafe_allow_html=True)
+    uploaded = st.file_uploader("Registry File:", type=UPLOAD_TYPES,
+                                help="CSV or Excel file with the columns of the company registry.")
+    if uploaded is not None and st.button("Score File", help="Scores every company with the current weights."):
+        previous = st.session_state.get('upload_job')
+        if previous is not None:
+            previous.discard()
+        st.session_state['upload_job'] = ScoringJob(uploaded.name, uploaded.getvalue(), current_weights())
+
+    job = st.session_state.get('upload_job')
+    if job is None:
+        return
+    if job.active:
+        upload_progress(job)
+    else:
+        show_upload_job(job)
+
+
+# Main content layout
+company_tab, portfolio_tab, upload_tab = st.tabs(["Company", "Portfolio", "Upload"])
+
+with company_tab:
+    st.markdown("<h2 class='sub-header'>Company Details and Risk Score Calculation</h2>", unsafe_allow_html=True)
+
+    # Create a row with two columns
+    col1, col2 = st.columns([2, 1])
+
+    with col1:
+        st.markdown("### Selected Company Information")
+        company_details()
+
+    with col2:
+        st.markdown("### Calculate Risk Score")
+        # Place the "Calculate Risk Score" button here to align with "View Company Details"
+        st.button("Calculate Risk Score", on_click=calculate_selected)
+
+    score_panel()
+
+with portfolio_tab:
+    portfolio_panel()
+
+with upload_tab:
+    upload_panel()
+
+# Per-factor timings, when the app runs with RISK_FACTOR_TIMING=1
+if factor_timing_enabled():
+    with st.expander("Factor Timings"):
+        st.dataframe(timing_summary(), hide_index=True)
+        if st.button("Reset Timings"):
+            reset_factor_timing()
+
+st.session_state['full_run'] = False
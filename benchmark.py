@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from calculate_risk import calculate_risk_score
+from registry import load_registry
+from risk_engine import DEFAULT_WEIGHTS, FACTOR_SCORERS, FACTORS, apply_weights, factor_matrix, score_companies, top_k
+from risk_writers import open_writer
+from snapshot_cache import SNAPSHOT_DIR, _snapshot_paths
+
+
+# Reproducible timings of the scoring pipeline. Inputs with the 3k_extended.csv schema are
+# generated at each size by sampling its rows with a fixed seed, then every stage is timed:
+# load (cold, from the source, and warm, from the snapshot), each factor of the engine, the
+# full engine, re-weighting, ranking and writing. The legacy calculate_risk_score row path is
+# timed on a sample of each input and checked against the engine on the same rows.
+# Results go to a JSON file; --compare prints the change against an earlier one.
+
+TEMPLATE_PATH = './data/3k_extended.csv'
+BENCH_DIR = './data/.bench'
+RESULTS_PATH = './benchmark_results.json'
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+# Rows scored through the legacy row path per size; it runs at a few thousand rows a second
+LEGACY_ROWS = 10_000
+
+WRITE_FORMATS = ['csv', 'parquet']
+RANK_TOP_K = 100
+GENERATE_CHUNK_SIZE = 100_000
+
+
+def generate_input(n_rows, path, seed=0, template_path=TEMPLATE_PATH):
+    # n_rows of template rows drawn with replacement, written in chunks. id and company_id
+    # are renumbered so every generated company is distinct
+    template = pd.read_csv(template_path)
+    rng = np.random.default_rng(seed)
+    tmp_path = f"{path}.tmp"
+    for start in range(0, n_rows, GENERATE_CHUNK_SIZE):
+        stop = min(start + GENERATE_CHUNK_SIZE, n_rows)
+        chunk = template.iloc[rng.integers(0, len(template), stop - start)].reset_index(drop=True)
+        chunk['id'] = chunk['company_id'] = np.arange(start + 1, stop + 1)
+        chunk.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    os.replace(tmp_path, path)
+
+
+def input_path(n_rows, seed, bench_dir=BENCH_DIR):
+    os.makedirs(bench_dir, exist_ok=True)
+    path = os.path.join(bench_dir, f"registry_{n_rows}_seed{seed}.csv")
+    if not os.path.exists(path):
+        print(f"Generating {n_rows} rows into {path}")
+        generate_input(n_rows, path, seed)
+    return path
+
+
+def timed(function, *args, repeat=1):
+    # Best wall time over repeat calls, and the result of the last one
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def drop_snapshot(path):
+    for snapshot_file in _snapshot_paths(path, SNAPSHOT_DIR):
+        if os.path.exists(snapshot_file):
+            os.remove(snapshot_file)
+
+
+def legacy_scores(df):
+    return pd.DataFrame([calculate_risk_score(row) for _, row in df.iterrows()], index=df.index)
+
+
+def bench_legacy(path, n_rows):
+    # Legacy row path against the engine on the first n_rows of the raw source, read the way
+    # the original script read it
+    df = pd.read_csv(path, nrows=n_rows)
+    legacy_time, legacy = timed(legacy_scores, df)
+    engine_time, engine = timed(score_companies, df)
+    try:
+        pd.testing.assert_frame_equal(legacy, engine, check_exact=True)
+        matches = True
+    except AssertionError:
+        matches = False
+    return {'rows': len(df), 'legacy_seconds': legacy_time, 'engine_seconds': engine_time,
+            'speedup': legacy_time / engine_time, 'matches': matches}
+
+
+def bench_size(n_rows, seed, repeat, legacy_rows, write_formats, bench_dir):
+    path = input_path(n_rows, seed, bench_dir)
+    stages = {}
+
+    drop_snapshot(path)
+    stages['load_cold'], _ = timed(lambda: load_registry([path], report=False))
+    stages['load_warm'], df = timed(lambda: load_registry([path], report=False), repeat=repeat)
+
+    for factor in FACTORS:
+        stages[f"factor.{factor}"], _ = timed(FACTOR_SCORERS[factor], df, repeat=repeat)
+    stages['factor_matrix'], matrix = timed(factor_matrix, df, repeat=repeat)
+    stages['reweight'], totals = timed(apply_weights, matrix, DEFAULT_WEIGHTS, repeat=repeat)
+    stages['score'], scores = timed(score_companies, df, None, matrix, repeat=repeat)
+    stages['score_from_source'], _ = timed(score_companies, df, repeat=repeat)
+
+    totals = pd.Series(totals, index=df.index)
+    stages['rank.top_k'], _ = timed(top_k, df, totals, RANK_TOP_K, repeat=repeat)
+    stages['rank.sort'], _ = timed(lambda: totals.sort_values(ascending=False, kind='stable'), repeat=repeat)
+
+    scored = pd.concat([df, scores], axis=1)
+    for fmt in write_formats:
+        output = os.path.join(bench_dir, f"scores_{n_rows}.{fmt}")
+        stages[f"write.{fmt}"], _ = timed(write_result, scored, output, fmt)
+        os.remove(output)
+
+    run = {'rows': n_rows, 'seed': seed, 'stages': stages}
+    if legacy_rows:
+        run['legacy'] = bench_legacy(path, min(legacy_rows, n_rows))
+    return run
+
+
+def write_result(df, path, fmt):
+    with open_writer(path, fmt) as writer:
+        writer.write(df)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def print_run(run):
+    n_rows = run['rows']
+    print(f"\n{n_rows} rows")
+    print(f"{'Stage':<32}{'Seconds':>12}{'Rows/s':>16}")
+    for stage, seconds in run['stages'].items():
+        print(f"{stage:<32}{seconds:>12.4f}{n_rows / seconds if seconds else float('inf'):>16,.0f}")
+    if 'legacy' in run:
+        legacy = run['legacy']
+        print(f"Legacy row path on {legacy['rows']} rows: {legacy['legacy_seconds']:.4f}s vs engine "
+              f"{legacy['engine_seconds']:.4f}s ({legacy['speedup']:.0f}x), "
+              f"results {'match' if legacy['matches'] else 'DIFFER'}")
+
+
+def compare(results, baseline_path):
+    # Ratio of each stage's time to the same stage at the same size in an earlier results file
+    with open(baseline_path) as f:
+        baseline = {run['rows']: run['stages'] for run in json.load(f)['runs']}
+    print(f"\nCompared with {baseline_path} (ratio > 1 is slower)")
+    for run in results['runs']:
+        previous = baseline.get(run['rows'])
+        if previous is None:
+            continue
+        print(f"\n{run['rows']} rows")
+        for stage, seconds in run['stages'].items():
+            if previous.get(stage):
+                print(f"{stage:<32}{seconds / previous[stage]:>8.2f}x")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scoring pipeline on generated registries.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help=f"Rows per generated input (default: {' '.join(map(str, SIZES))})")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the generated inputs (default: 0)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Timed calls per stage, the best one is kept (default: 3)")
+    parser.add_argument('--legacy-rows', type=int, default=LEGACY_ROWS,
+                        help=f"Rows scored through the legacy row path per size, 0 to skip (default: {LEGACY_ROWS})")
+    parser.add_argument('--formats', nargs='*', default=WRITE_FORMATS,
+                        help=f"Output formats to time (default: {' '.join(WRITE_FORMATS)})")
+    parser.add_argument('--bench-dir', default=BENCH_DIR, help=f"Generated inputs and outputs (default: {BENCH_DIR})")
+    parser.add_argument('-o', '--output', default=RESULTS_PATH, help=f"Results file (default: {RESULTS_PATH})")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {'environment': environment(), 'runs': []}
+    for n_rows in args.sizes:
+        run = bench_size(n_rows, args.seed, args.repeat, args.legacy_rows, args.formats, args.bench_dir)
+        print_run(run)
+        results['runs'].append(run)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nBenchmark results saved to '{args.output}'")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,17 @@
-import pandas as pd
-import numpy as np
-from datetime import datetime
+import argparse
+import json
 import re
-import requests
-import pandas as pd
-from joblib import Parallel, delayed
 import time
 
+import pandas as pd
+
+from factor_timing import enable as enable_factor_timing, print_timing_summary, time_factor
+from risk_engine import (DEFAULT_WEIGHTS, FACTORS, SCORE_COLUMNS, score_companies, count_unknown_categories,
+                         feature_columns, top_k)
+from registry import PROVENANCE_COLUMNS, load_registry, load_columns, registry_columns
+from risk_pipeline import iter_registry_chunks, score_stream, score_parallel, incremental_factor_matrix, stream_columns
+from risk_writers import WRITERS, open_writer
+
 
 def clean_text(text):
     return re.sub(r'[^\w\s]', '', str(text)).lower().strip()
@@ -249,19 +254,21 @@ def calculate_risk_score(row):
         'Branch': 0.10  # New weight for branch factor
     }
 
-    scores['Economic Zone_raw'] = calculate_economic_zone_score(row.get('economic_department', ''))
+    scores['Economic Zone_raw'] = time_factor('Economic Zone', calculate_economic_zone_score,
+                                              row.get('economic_department', ''))
     scores['Economic Zone'] = scores['Economic Zone_raw'] * weights['Economic Zone']
 
-    scores['Date of Operations_raw'] = calculate_date_of_operations_score(row.get('est_date'), row.get('expiry_date'))
+    scores['Date of Operations_raw'] = time_factor('Date of Operations', calculate_date_of_operations_score,
+                                                   row.get('est_date'), row.get('expiry_date'))
     scores['Date of Operations'] = scores['Date of Operations_raw'] * weights['Date of Operations']
 
-    scores['Status_raw'] = calculate_status_score(row.get('status', ''))
+    scores['Status_raw'] = time_factor('Status', calculate_status_score, row.get('status', ''))
     scores['Status'] = scores['Status_raw'] * weights['Status']
 
-    scores['Legal Type_raw'] = calculate_legal_type_score(row.get('legal_type', ''))
+    scores['Legal Type_raw'] = time_factor('Legal Type', calculate_legal_type_score, row.get('legal_type', ''))
     scores['Legal Type'] = scores['Legal Type_raw'] * weights['Legal Type']
 
-    scores['WPS_raw'] = calculate_wps_score(row.get('wps', ''))
+    scores['WPS_raw'] = time_factor('WPS', calculate_wps_score, row.get('wps', ''))
     scores['WPS'] = scores['WPS_raw'] * weights['WPS']
 
     # Visa score calculations
@@ -270,14 +277,15 @@ def calculate_risk_score(row):
     visa_requested = row.get('visa_requested', 0)
     visa_used = row.get('visa_used', 0)
 
-    scores['Visa Ratio_raw'] = calculate_visa_ratio_score(visa_approved, visa_cancelled, visa_requested, visa_used)
+    scores['Visa Ratio_raw'] = time_factor('Visa Ratio', calculate_visa_ratio_score,
+                                           visa_approved, visa_cancelled, visa_requested, visa_used)
     scores['Visa Ratio'] = scores['Visa Ratio_raw'] * weights['Visa Ratio']
 
-    scores['Visa Number_raw'] = calculate_visa_number_score(visa_approved, visa_cancelled)
+    scores['Visa Number_raw'] = time_factor('Visa Number', calculate_visa_number_score, visa_approved, visa_cancelled)
     scores['Visa Number'] = scores['Visa Number_raw'] * weights['Visa Number']
 
     # Branch score calculation
-    scores['Branch_raw'] = calculate_branch_score(row.get('is_branch', False))
+    scores['Branch_raw'] = time_factor('Branch', calculate_branch_score, row.get('is_branch', False))
     scores['Branch'] = scores['Branch_raw'] * weights['Branch']
 
     # Phone score calculation
@@ -291,13 +299,13 @@ def calculate_risk_score(row):
     else:
         phone_number = ''
 
-    scores['Phone_raw'] = calculate_phone_score(phone_number)
+    scores['Phone_raw'] = time_factor('Phone', calculate_phone_score, phone_number)
     scores['Phone'] = scores['Phone_raw'] * weights['Phone']
 
-    scores['Website_raw'] = calculate_website_score(row.get('website', ''))
+    scores['Website_raw'] = time_factor('Website', calculate_website_score, row.get('website', ''))
     scores['Website'] = scores['Website_raw'] * weights['Website']
 
-    scores['Email_raw'] = calculate_email_score(row.get('email', ''))
+    scores['Email_raw'] = time_factor('Email', calculate_email_score, row.get('email', ''))
     scores['Email'] = scores['Email_raw'] * weights['Email']
 
     scores['Total_raw'] = sum(scores[k + '_raw'] for k in weights.keys())
@@ -306,50 +314,163 @@ def calculate_risk_score(row):
     return scores
 
 
-# Load the Excel file
-df_org = pd.read_excel('./data/appro-companies.xlsx', engine='openpyxl')
-df_extended = pd.read_csv('./data/3k_extended.csv')
-
-df = pd.concat([df_org, df_extended], ignore_index=True)
-df.reset_index(drop= True, inplace=True)
-
-# Print column names and first few rows
-print("Column names:")
-print(df.columns.tolist())
-print("\nFirst few rows:")
-print(df.head())
-
-# Define a batch size
-batch_size = int(round((len(df) / 8 + 1), 0))  # For example, to create 8 batches
-print(batch_size)
-
-all_risk_scores = []
-start_time_apply = time.time()
-# Process in batches
-for i in range(0, len(df), batch_size):
-    batch = df.iloc[i:i + batch_size]
-    risk_scores_batch = Parallel(n_jobs=-1)(delayed(calculate_risk_score)(row) for _, row in batch.iterrows())
-    # Append the results of the current batch to the overall results list
-    all_risk_scores.extend(risk_scores_batch)
-
-end_time_apply = time.time()
-# Calculate execution times
-parallel_time = end_time_apply - start_time_apply
-
-print(f"Parallel execution time: {parallel_time:.4f} seconds")
-
-risk_scores = pd.Series(all_risk_scores)
+# Registry sources scored when no inputs are given, in this order
+SOURCES = ['./data/appro-companies.xlsx', './data/3k_extended.csv']
+
+OUTPUT_PATH = './data/company_risk_scores.xlsx'
+TOP_OUTPUT_PATH = './data/company_risk_top.xlsx'
+
+
+def load_weights(path):
+    # Factor weights from a JSON object such as {"WPS": 0.1}; factors it leaves out keep
+    # their default weight
+    if path is None:
+        return dict(DEFAULT_WEIGHTS)
+    with open(path) as f:
+        weights = json.load(f)
+    unknown = sorted(set(weights) - set(FACTORS))
+    if unknown:
+        raise ValueError(f"Unknown factors in {path}: {unknown}; expected some of {FACTORS}")
+    return {**DEFAULT_WEIGHTS, **{factor: float(weight) for factor, weight in weights.items()}}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score companies in the registry sources and rank them.")
+    parser.add_argument('inputs', nargs='*', default=SOURCES,
+                        help="Registry files (.xlsx/.csv/.parquet) to score, in order (default: the bundled sources)")
+    parser.add_argument('-o', '--output', default=OUTPUT_PATH, help=f"Output file (default: {OUTPUT_PATH})")
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS),
+                        help="Output format (default: from the output file's extension)")
+    parser.add_argument('--scores-only', action='store_true',
+                        help="Write only the ID and score columns instead of every input column")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="Worker processes for scoring (default: 1, score in this process)")
+    parser.add_argument('-c', '--chunk-size', type=int,
+                        help="Stream the inputs in chunks of this many rows to bound memory; the output then "
+                             "keeps input order and the ranking goes to --top-output")
+    parser.add_argument('--top-n', type=int, default=500,
+                        help="Companies kept for the ranking in streaming mode (default: 500)")
+    parser.add_argument('--top-output', default=TOP_OUTPUT_PATH,
+                        help=f"Ranking file in streaming mode (default: {TOP_OUTPUT_PATH})")
+    parser.add_argument('-k', '--top-k', type=int,
+                        help="Write only the top K companies instead of the whole sorted registry")
+    parser.add_argument('--weights', help="JSON file of factor weights overriding the defaults")
+    parser.add_argument('--prefer', nargs='+', metavar='INPUT',
+                        help="Inputs whose rows win when a company is listed more than once, in order "
+                             "(default: input order)")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Score every input row, even companies listed more than once")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Rescore only companies whose scoring inputs changed since the previous run")
+    parser.add_argument('--wps-flags', action='store_true',
+                        help="Also write one true/false column per negative WPS status the company has")
+    parser.add_argument('--contact-features', action='store_true',
+                        help="Also write each company's normalized phone number, phone type and email domain")
+    parser.add_argument('--profile-factors', action='store_true',
+                        help="Time each factor computation and print a summary at the end of the run")
+    args = parser.parse_args(argv)
+    # Combinations one of the modes would otherwise silently ignore
+    if args.chunk_size and args.incremental:
+        parser.error("--incremental cannot be combined with -c/--chunk-size")
+    if args.chunk_size and args.top_k:
+        parser.error("-k/--top-k cannot be combined with -c/--chunk-size; use --top-n and --top-output")
+    if args.incremental and args.workers > 1:
+        parser.error("-w/--workers cannot be combined with --incremental")
+    if args.prefer and args.keep_duplicates:
+        parser.error("--prefer cannot be combined with --keep-duplicates, which keeps every listing")
+    return args
+
+
+def run_streaming(args, weights):
+    start_time_apply = time.time()
+    chunks = iter_registry_chunks(args.inputs, args.chunk_size, dedup=not args.keep_duplicates, precedence=args.prefer)
+    # Every source's columns, in the same order as a non-streaming run
+    features = feature_columns(args.wps_flags, args.contact_features)
+    columns = (stream_columns(args.inputs) + ([] if args.keep_duplicates else PROVENANCE_COLUMNS) + SCORE_COLUMNS
+               + features)
+    with open_writer(args.output, args.format, args.scores_only, features) as writer:
+        df_top, row_count = score_stream(chunks, writer, top_n=args.top_n, weights=weights, n_workers=args.workers,
+                                         columns=columns, include_wps_flags=args.wps_flags,
+                                         include_contact_features=args.contact_features)
+    streaming_time = time.time() - start_time_apply
+    print(f"Streaming execution time: {streaming_time:.4f} seconds for {row_count} rows")
+
+    with open_writer(args.top_output, scores_only=args.scores_only) as writer:
+        writer.write(df_top)
+
+    print(f"Risk scores saved to '{args.output}', top companies to '{args.top_output}'")
+
+
+def run(args, weights):
+    # Load and merge the registry sources, only the columns scoring needs
+    df = load_registry(args.inputs, dedup=not args.keep_duplicates, precedence=args.prefer)
+
+    # Print column names and first few rows
+    print("Column names:")
+    print(df.columns.tolist())
+    print("\nFirst few rows:")
+    print(df.head())
+
+    features = feature_columns(args.wps_flags, args.contact_features)
+    start_time_apply = time.time()
+    # Score every company column-wise; same columns as calculate_risk_score(row) per row
+    if args.incremental:
+        factor_scores, change_counts = incremental_factor_matrix(df)
+        print(f"Incremental run: {change_counts}")
+        risk_score_df = score_companies(df, weights, matrix=factor_scores, include_wps_flags=args.wps_flags,
+                                        include_contact_features=args.contact_features)
+    elif args.workers > 1:
+        risk_score_df = score_parallel(df, args.workers, weights, include_wps_flags=args.wps_flags,
+                                       include_contact_features=args.contact_features)
+    else:
+        risk_score_df = score_companies(df, weights, include_wps_flags=args.wps_flags,
+                                        include_contact_features=args.contact_features)
 
-# Convert the list of dictionaries to a DataFrame
-risk_score_df = pd.DataFrame(risk_scores.tolist())
+    end_time_apply = time.time()
+    # Calculate execution times
+    vectorized_time = end_time_apply - start_time_apply
 
-# Concatenate the original DataFrame with the risk score DataFrame
-df_with_scores = pd.concat([df, risk_score_df], axis=1)
+    print(f"Vectorized execution time: {vectorized_time:.4f} seconds")
+    print(f"Rows with unrecognised categories: {count_unknown_categories(df)}")
 
-# Sort companies by total risk score (highest to lowest)
-df_sorted = df_with_scores.sort_values('Total_weight_adjusted', ascending=False)
+    if args.top_k:
+        # Select the top companies on the score array, then materialize only their rows
+        df_top = top_k(df, risk_score_df['Total_weight_adjusted'], args.top_k)
+        df_sorted = pd.concat([df_top, risk_score_df.loc[df_top.index]], axis=1)
+    else:
+        # Concatenate the original DataFrame with the risk score DataFrame
+        df_with_scores = pd.concat([df, risk_score_df], axis=1)
+
+        # Sort companies by total risk score (highest to lowest)
+        df_sorted = df_with_scores.sort_values('Total_weight_adjusted', ascending=False)
+
+    if not args.scores_only:
+        # Bring back the input columns scoring did not need, for the output rows only
+        df_rest = load_columns(args.inputs, exclude=df.columns, rows=df_sorted.index.sort_values().to_numpy())
+        df_sorted = df_sorted.join(df_rest)
+        columns = registry_columns(args.inputs) + PROVENANCE_COLUMNS
+        df_sorted = df_sorted[[column for column in columns if column in df_sorted.columns] + SCORE_COLUMNS
+                              + features]
+
+    # Save results
+    with open_writer(args.output, args.format, args.scores_only, features) as writer:
+        writer.write(df_sorted)
+
+    print(f"Risk scores calculated and saved to '{args.output}'")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    weights = load_weights(args.weights)
+    if args.profile_factors:
+        enable_factor_timing()
+    if args.chunk_size:
+        run_streaming(args, weights)
+    else:
+        run(args, weights)
+    if args.profile_factors:
+        print_timing_summary()
 
-# Save results to a new Excel file
-df_sorted.to_excel('./data/company_risk_scores.xlsx', index=False, engine='openpyxl')
 
-print("Risk scores calculated and saved to 'company_risk_scores.xlsx'")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import bisect
+import re
+
+import numpy as np
+import pandas as pd
+
+from registry import _id_text
+
+
+# Type-ahead search over a loaded registry. Every word of the searchable columns is indexed
+# once, sorted, with the rows it occurs in; a query word then matches every indexed word it
+# is a prefix of through two binary searches, and a query of several words matches companies
+# containing all of them. English names are also indexed whole, so that names starting with
+# the query can be listed first. Only the best `limit` matches are returned, so an app sends a
+# handful of options to the browser however large the registry is.
+#
+# Rows are identified inside the index by their rank in the default result order (shorter
+# English names first, then registry order), so the best matches of a posting list are simply
+# its smallest values.
+
+SEARCH_COLUMNS = ['business_name_english', 'business_name_arabic', 'bl_local_no']
+
+SEARCH_LIMIT = 20
+
+_WORD = re.compile(r'\w+')
+
+# Sorts after any text starting with a given prefix
+_PREFIX_END = '\U0010ffff'
+
+
+def _search_text(df, column):
+    if column not in df.columns:
+        return pd.Series('', index=range(len(df)), dtype=object)
+    values = _id_text(df[column]) if column == 'bl_local_no' else df[column]
+    return pd.Series(values.to_numpy(), dtype=object).where(values.notna().to_numpy(), '').astype(str).str.casefold()
+
+
+def _prefix_range(sorted_texts, prefix):
+    start = bisect.bisect_left(sorted_texts, prefix)
+    return start, bisect.bisect_left(sorted_texts, prefix + _PREFIX_END, start)
+
+
+def _smallest(values, limit):
+    # The limit smallest distinct values, in order, without sorting all of them
+    if len(values) > 4 * limit:
+        smallest = np.unique(np.partition(values, 4 * limit)[:4 * limit])
+        if len(smallest) >= limit:
+            return smallest[:limit]
+    return np.unique(values)[:limit]
+
+
+class CompanySearch:
+    def __init__(self, df, columns=SEARCH_COLUMNS):
+        names = _search_text(df, 'business_name_english')
+        self._positions = np.lexsort((np.arange(len(df)), names.str.len().to_numpy()))
+        rank = np.empty(len(df), dtype=np.int64)
+        rank[self._positions] = np.arange(len(df))
+
+        texts = [_search_text(df, column) for column in columns if column in df.columns]
+        # Distinct (word, rank) pairs sorted by word then rank; the pairs of the vocabulary's
+        # i-th word are _ranks[_offsets[i]:_offsets[i + 1]]
+        words = pd.concat([text.str.findall(_WORD) for text in texts]).explode().dropna()
+        codes, vocabulary = pd.factorize(words.to_numpy(dtype=object))
+        order = np.argsort(vocabulary)
+        word_order = np.empty(len(order), dtype=np.int64)
+        word_order[order] = np.arange(len(order))
+        pairs = np.unique(word_order[codes] * len(df) + rank[words.index.to_numpy()])
+        self._words = vocabulary[order].tolist()
+        self._ranks = pairs % len(df)
+        self._offsets = np.searchsorted(pairs // len(df), np.arange(len(order) + 1))
+
+        name_order = np.argsort(names.to_numpy(dtype=object), kind='stable')
+        self._names = names.to_numpy(dtype=object)[name_order].tolist()
+        self._name_ranks = rank[name_order]
+
+    def _word_matches(self, word):
+        # Ranks of rows with an indexed word starting with word, possibly repeated
+        start, stop = _prefix_range(self._words, word)
+        return self._ranks[self._offsets[start]:self._offsets[stop]]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        # Positions of up to limit companies matching every word of query: those whose English
+        # name starts with the query first, then the rest, each in the default result order
+        words = _WORD.findall(query.casefold())
+        if not words:
+            return []
+        # Start from the rarest word, keeping the rows every other word matches too
+        word_matches = sorted((self._word_matches(word) for word in words), key=len)
+        matches = word_matches[0]
+        if len(words) > 1:
+            matches = np.unique(matches)
+            for other in word_matches[1:]:
+                matches = matches[np.isin(matches, other)]
+        if not len(matches):
+            return []
+
+        start, stop = _prefix_range(self._names, ' '.join(words))
+        leading = self._name_ranks[start:stop]
+        if len(words) > 1:
+            leading = leading[np.isin(leading, matches)]
+        best = _smallest(leading, limit)
+        if len(best) < limit:
+            rest = matches[~np.isin(matches, best)]
+            best = np.concatenate([best, _smallest(rest, limit - len(best))])
+        return self._positions[best].tolist()
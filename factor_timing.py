@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+# Opt-in timing of each factor computation. Scoring code calls its factor functions through
+# time_factor(factor, function, *args); while timing is off that is a single flag check before
+# the call. Turn it on with enable() or by setting RISK_FACTOR_TIMING=1 in the environment.
+# Stats are per process: workers of risk_pipeline.score_parallel are not included.
+
+_enabled = os.environ.get('RISK_FACTOR_TIMING', '') not in ('', '0')
+
+# factor -> [calls, total seconds, max seconds]
+_stats = {}
+_lock = threading.Lock()
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def time_factor(factor, function, *args):
+    if not _enabled:
+        return function(*args)
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            stats = _stats.setdefault(factor, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+
+def timing_summary():
+    # One row per timed factor, slowest in total first
+    with _lock:
+        rows = [(factor, calls, total, total / calls * 1000, longest * 1000)
+                for factor, (calls, total, longest) in _stats.items()]
+    summary = pd.DataFrame(rows, columns=['Factor', 'Calls', 'Total (s)', 'Mean (ms)', 'Max (ms)'])
+    return summary.sort_values('Total (s)', ascending=False, ignore_index=True)
+
+
+def print_timing_summary():
+    summary = timing_summary()
+    if summary.empty:
+        print("No factor timings recorded")
+        return
+    print("\nFactor timings:")
+    print(summary.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
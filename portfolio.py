@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from risk_engine import FACTORS, weight_vector
+
+
+# Server-side paging of the whole scored portfolio. The app keeps the factor matrix of every
+# loaded company; on each rerun it re-weights it, narrows it down with the filters and sorts
+# only as far as the requested page, so a page of a few dozen rows is all that is built into
+# a DataFrame and sent to the browser.
+
+PAGE_SIZES = [25, 50, 100]
+
+NAME_COLUMN = 'Business Name'
+
+# Columns the portfolio can be sorted on: the weighted total, each weighted factor and the name
+SORT_COLUMNS = ['Total'] + FACTORS + [NAME_COLUMN]
+
+# Registry columns shown next to the scores, named apart from the factors scoring them
+INFO_COLUMNS = {'business_name_english': NAME_COLUMN, 'bl_local_no': 'Licence No',
+                'economic_department': 'Economic Department', 'status': 'Company Status',
+                'legal_type': 'Company Legal Type'}
+
+
+def name_ranks(df):
+    # Position of each company in the case-insensitive English name order, missing names last,
+    # so sorting by name is a numeric sort like every other column
+    names = df['business_name_english'].astype('string').str.casefold().reset_index(drop=True)
+    order = names.sort_values(kind='stable', na_position='last').index.to_numpy()
+    ranks = np.empty(len(df), dtype=np.int64)
+    ranks[order] = np.arange(len(df))
+    return ranks
+
+
+def category_codes(df, columns):
+    # Per column, each row's position in its category_options values (-1 when missing)
+    return {column: pd.factorize(df[column])[0] for column in columns}
+
+
+def filter_positions(n_rows, totals, min_total=None, code_filters=(), positions=None):
+    # Ascending positions of the rows passing every filter: a minimum total, (codes, allowed
+    # codes) pairs from category_codes, and an optional array of positions (e.g. search matches)
+    mask = np.ones(n_rows, dtype=bool)
+    if min_total is not None:
+        mask &= totals >= min_total
+    for codes, allowed in code_filters:
+        mask &= np.isin(codes, allowed)
+    if positions is not None:
+        allowed_positions = np.zeros(n_rows, dtype=bool)
+        allowed_positions[positions] = True
+        mask &= allowed_positions
+    return np.flatnonzero(mask)
+
+
+def sort_keys(matrix, weights, totals, ranks, column):
+    # Ascending key of every row for a SORT_COLUMNS entry
+    if column == 'Total':
+        return totals
+    if column == NAME_COLUMN:
+        return ranks.astype(float)
+    return matrix[:, FACTORS.index(column)] * weights[column]
+
+
+def page_positions(keys, positions, page, page_size, descending=True):
+    # Positions of one page of the filtered rows ordered by key, ties in registry order. Only
+    # the rows up to the end of the page are sorted, found with a partition as in top_k
+    stop = min((page + 1) * page_size, len(positions))
+    start = page * page_size
+    if start >= stop:
+        return positions[:0]
+
+    key = keys[positions]
+    key = -key if descending else key.copy()
+    key[np.isnan(key)] = np.inf
+    if stop < len(key):
+        threshold = np.partition(key, stop - 1)[stop - 1]
+        # Everything tied with the last row of the page stays a candidate so the order is exact
+        candidates = np.flatnonzero(key <= threshold)
+    else:
+        candidates = np.arange(len(key))
+    order = candidates[np.argsort(key[candidates], kind='stable')]
+    return positions[order[start:stop]]
+
+
+def page_frame(df, matrix, weights, totals, positions, first_row=1):
+    # The rows of one page: a running number, the INFO_COLUMNS, the weighted total and each
+    # weighted factor
+    columns = [column for column in INFO_COLUMNS if column in df.columns]
+    page = df.iloc[positions][columns].rename(columns=INFO_COLUMNS).reset_index(drop=True)
+    page.insert(0, '#', np.arange(first_row, first_row + len(positions)))
+    page['Total'] = totals[positions]
+    weighted = matrix[positions] * weight_vector(weights)
+    for i, factor in enumerate(FACTORS):
+        page[factor] = weighted[:, i]
+    return page
@@ -0,0 +1,287 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from risk_engine import DATE_FORMATS, parse_dates
+from snapshot_cache import pa, read_source, source_columns, source_rows
+
+
+# Loading the registry for scoring, and company identity across its sources.
+#
+# The batch loader reads only the columns declared in a schema, with compact dtypes, instead
+# of all 75 columns as inferred objects. Other columns are loaded on demand for output.
+#
+# bl_local_no alone is not unique (licence numbers are reused between emirates) and
+# company_id is missing for many CSV rows, so a company is identified by the pair.
+#
+# A company listed by several sources is kept once, from the source that comes first in the
+# precedence order (load order by default), with its provenance in PROVENANCE_COLUMNS.
+
+# Columns needed to identify and score a company, and their in-memory dtypes. Columns a
+# source does not have (e.g. website) are skipped
+SCORING_SCHEMA = {
+    'company_id': 'Int64',
+    'bl_local_no': 'string',
+    'business_name_english': 'string',
+    'economic_department': 'category',
+    'legal_type': 'category',
+    'status': 'category',
+    'wps': 'category',
+    'is_branch': 'category',
+    'est_date': 'datetime64[ns]',
+    'expiry_date': 'datetime64[ns]',
+    'visa_approved': 'Int32',
+    'visa_cancelled': 'Int32',
+    'visa_requested': 'Int32',
+    'visa_used': 'Int32',
+    'phone_no': 'string',
+    'mobile_no': 'string',
+    'website': 'string',
+    'email': 'string'
+}
+
+
+def _id_text(values):
+    # '451610' for 451610, 451610.0 and '451610'; '' when missing
+    if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+        text = values.astype('Int64').astype(str)
+    elif pd.api.types.is_numeric_dtype(values):
+        text = values.astype(str)
+    else:
+        text = values.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    return text.where(values.notna(), '').astype(object)
+
+
+def company_keys(df):
+    # 'company_id|bl_local_no' per row
+    company_id = _id_text(df['company_id']) if 'company_id' in df.columns else ''
+    bl_local_no = _id_text(df['bl_local_no']) if 'bl_local_no' in df.columns else ''
+    return pd.Series(company_id + '|' + bl_local_no, index=df.index, dtype=object)
+
+
+def company_key_hashes(df):
+    # company_keys as 64-bit hashes, 8 bytes a row instead of a Python string, for deduplicating
+    # sources too large to hold every key; and which rows have no id at all. Distinct keys
+    # colliding is possible but negligible (about 1 in 10**5 for 20M companies)
+    keys = company_keys(df)
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy(), keys.to_numpy() == '|'
+
+
+# 'source': where the kept row came from; 'sources': every source listing the company,
+# separated by ';' in load order
+PROVENANCE_COLUMNS = ['source', 'sources']
+
+
+def dedup_rows(keys, source_index, names, precedence=None, anonymous=None):
+    # Which rows to keep, one per company key, and each row's 'sources' label. source_index[i]
+    # is the position in names of the source row i came from; sources listed in precedence win,
+    # in that order, then the rest in load order. Rows without any id ('|', or flagged in
+    # anonymous when keys are hashes) are all kept.
+    # Linear: keys are factorized through a hash table, then per-company minima and source
+    # bitmasks are accumulated in one pass each
+    unknown = sorted(set(precedence or ()) - set(names))
+    if unknown:
+        raise ValueError(f"Unknown sources in precedence: {unknown}; expected some of {names}")
+    order = list(precedence or ()) + [name for name in names if name not in (precedence or ())]
+    rank = np.array([order.index(name) for name in names])[source_index]
+
+    codes, uniques = pd.factorize(keys)
+    if anonymous is None:
+        anonymous = np.asarray(keys) == '|'
+    codes[anonymous] = len(uniques) + np.arange(anonymous.sum())
+    n_companies = len(uniques) + anonymous.sum()
+
+    best = np.full(n_companies, len(names))
+    np.minimum.at(best, codes, rank)
+    keep = rank == best[codes]
+    kept = np.flatnonzero(keep)
+    keep[kept[pd.Series(codes[kept]).duplicated().to_numpy()]] = False
+
+    masks = np.zeros(n_companies, dtype=np.int64)
+    np.bitwise_or.at(masks, codes, np.left_shift(1, source_index).astype(np.int64))
+    mask_codes, mask_values = pd.factorize(masks[codes])
+    labels = [';'.join(name for bit, name in enumerate(names) if mask >> bit & 1) for mask in mask_values]
+    return keep, pd.Categorical.from_codes(mask_codes, categories=pd.Index(labels))
+
+
+def merge_sources(frames, precedence=None, ignore_index=False):
+    # Concatenation of frames ({source name: DataFrame}, in load order) with one row per company,
+    # plus PROVENANCE_COLUMNS. Kept rows keep their position in the full concatenation as index
+    # unless ignore_index
+    names = list(frames)
+    df = pd.concat(frames.values(), ignore_index=True)
+    source_index = np.repeat(np.arange(len(names)), [len(frame) for frame in frames.values()])
+    keep, sources = dedup_rows(company_keys(df), source_index, names, precedence)
+    df['source'] = pd.Categorical.from_codes(source_index, categories=pd.Index(names))
+    df['sources'] = sources
+    df = df[keep]
+    return df.reset_index(drop=True) if ignore_index else df
+
+
+class CompanyIndex:
+    # Row positions of a loaded registry by company key and display labels, built in one pass.
+    # A session keeps its selected company as a key rather than a row position, and finds it
+    # again with a dict lookup, so the selection survives the registry being reloaded. Names
+    # are not unique: distinct companies may share one, so label() tells them apart by
+    # licence number.
+    def __init__(self, df):
+        names = df['business_name_english'].astype(object).where(df['business_name_english'].notna(), '')
+        self._keys = company_keys(df).tolist()
+        # Rows without any id have no usable key
+        self._by_key = {key: position for position, key in enumerate(self._keys) if key != '|'}
+        shared = names.duplicated(keep=False).to_numpy()
+        bl_local_no = _id_text(df['bl_local_no']) if 'bl_local_no' in df.columns else ''
+        self._labels = names.where(~shared, names + ' (' + bl_local_no + ')').tolist()
+
+    def __len__(self):
+        return len(self._labels)
+
+    def key(self, position):
+        # company_keys() key of the company at position, None if it has no id
+        key = self._keys[position]
+        return None if key == '|' else key
+
+    def position(self, key):
+        # Position of the company with this company_keys() key, None if there is none
+        return self._by_key.get(key)
+
+    def label(self, position):
+        # Display name of the company at position, with its licence number if the name is shared
+        return self._labels[position]
+
+
+def category_options(df, columns):
+    # Per column, its distinct non-missing values in order of appearance and a value -> position
+    # dict, so a selectbox can preselect a company's value without scanning the options
+    options = {}
+    for column in columns:
+        values = df[column].dropna().unique().tolist()
+        options[column] = (values, {value: position for position, value in enumerate(values)})
+    return options
+
+
+def apply_schema(df, schema):
+    # Casts the schema's columns present in df to their declared dtypes
+    df = df.copy()
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        try:
+            if dtype.startswith('datetime64'):
+                df[column] = parse_dates(df[column], DATE_FORMATS.get(column, '%Y-%m-%d')).astype(dtype)
+            elif dtype.startswith(('Int', 'int')):
+                df[column] = pd.to_numeric(df[column], errors='raise').astype(dtype)
+            else:
+                df[column] = df[column].astype(dtype)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Column '{column}' cannot be loaded as {dtype}: {e}") from e
+    return df
+
+
+def _max_rss():
+    # Peak resident size of the process so far in bytes, None where the resource module is missing
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _proc_rss():
+    # Current resident size and its high-water mark in bytes, None where /proc is not available
+    sizes = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    sizes[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return None
+    return (sizes['VmRSS'], sizes['VmHWM']) if len(sizes) == 2 else None
+
+
+def _start_peak_rss():
+    # Resident size before a load, with the high-water mark reset to it on Linux so that it then
+    # tracks the peak of this load alone. Falls back to the process's peak so far elsewhere
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        rss = _proc_rss()
+        if rss is not None:
+            return 'hwm', rss[0]
+    except OSError:
+        pass
+    return 'maxrss', _max_rss()
+
+
+def _peak_rss_message(start):
+    # Report of the peak resident size since _start_peak_rss, or '' when it cannot be measured
+    kind, before = start
+    if before is None:
+        return ''
+    if kind == 'hwm':
+        rss = _proc_rss()
+        if rss is None:
+            return ''
+        peak = rss[1]
+    else:
+        peak = _max_rss()
+        # ru_maxrss only says something about this load when the load raised it
+        if peak <= before:
+            return f", peak not above the process's earlier peak of {before / 2 ** 20:.1f} MB"
+    return f", peak {peak / 2 ** 20:.1f} MB resident while loading ({(peak - before) / 2 ** 20:.1f} MB above the start)"
+
+
+def load_registry(paths, schema=SCORING_SCHEMA, report=True, dedup=True, precedence=None):
+    # Merge of the sources, projected to the schema's columns and cast to its dtypes. With dedup,
+    # a company listed more than once is kept once (see merge_sources) and the index keeps each
+    # row's position in the plain concatenation. With report, prints the frame's size, the memory
+    # still held by Arrow's pool and the peak resident size of the process during this load,
+    # which covers both Python and Arrow allocations at no cost to the load
+    start = _start_peak_rss() if report else None
+    frames = {}
+    for path in paths:
+        available = set(source_columns(path))
+        frames[path] = read_source(path, columns=[column for column in schema if column in available])
+    rows = sum(len(frame) for frame in frames.values())
+    if dedup:
+        df = apply_schema(merge_sources(frames, precedence), schema)
+    else:
+        df = apply_schema(pd.concat(frames.values(), ignore_index=True), schema)
+    if report:
+        size = df.memory_usage(deep=True).sum()
+        message = f"Loaded {len(df)} rows x {len(df.columns)} columns: {size / 2 ** 20:.1f} MB in memory"
+        if pa is not None:
+            message += f", {pa.total_allocated_bytes() / 2 ** 20:.1f} MB held by Arrow"
+        print(message + _peak_rss_message(start))
+        if dedup:
+            print(f"Dropped {rows - len(df)} duplicate rows of companies listed more than once")
+    return df
+
+
+def registry_columns(paths):
+    # Column names across the sources, in source order
+    return list(dict.fromkeys(column for path in paths for column in source_columns(path)))
+
+
+def load_columns(paths, exclude=(), rows=None):
+    # The sources' remaining columns (all but exclude), loaded only when an output needs
+    # them; indexed like load_registry(paths), so its rows can be joined on the index. rows,
+    # positions in the plain concatenation of the sources (that index), limits them to those
+    # rows, so only the rows being written are read
+    frames = []
+    start = 0
+    for path in paths:
+        columns = [column for column in source_columns(path) if column not in exclude]
+        if rows is None:
+            frames.append(read_source(path, columns=columns))
+            continue
+        stop = start + source_rows(path)
+        positions = rows[(rows >= start) & (rows < stop)]
+        frames.append(read_source(path, columns=columns, rows=positions - start).set_axis(positions))
+        start = stop
+    return pd.concat(frames, ignore_index=rows is None)
@@ -0,0 +1,496 @@
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+
+from factor_timing import time_factor
+
+
+# Column-wise version of the scoring in calculate_risk.py. Every factor takes whole
+# columns and returns an int64 array, so scoring a DataFrame costs a handful of
+# NumPy/pandas passes instead of one Python call per row and factor.
+
+# Same order as the weights dict in calculate_risk_score, which also fixes the order
+# the totals are summed in
+FACTORS = ['Economic Zone', 'Date of Operations', 'Status', 'Legal Type', 'WPS', 'Visa Number', 'Visa Ratio',
+           'Phone', 'Website', 'Email', 'Branch']
+
+DEFAULT_WEIGHTS = {
+    'Economic Zone': 0.15,
+    'Date of Operations': 0.30,
+    'Status': 0.10,
+    'Legal Type': 0.10,
+    'WPS': 0.05,
+    'Visa Number': 0.30,
+    'Visa Ratio': 0.30,
+    'Phone': 0.10,
+    'Website': 0.10,
+    'Email': 0.10,
+    'Branch': 0.10
+}
+
+# Column order produced by calculate_risk_score
+SCORE_COLUMNS = [
+    'Economic Zone_raw', 'Economic Zone', 'Date of Operations_raw', 'Date of Operations', 'Status_raw', 'Status',
+    'Legal Type_raw', 'Legal Type', 'WPS_raw', 'WPS', 'Visa Ratio_raw', 'Visa Ratio', 'Visa Number_raw',
+    'Visa Number', 'Branch_raw', 'Branch', 'Phone_raw', 'Phone', 'Website_raw', 'Website', 'Email_raw', 'Email',
+    'Total_raw', 'Total_weight_adjusted'
+]
+
+ECONOMIC_ZONE_SCORES = {
+    'Dubai Department of Economic Development': 15,
+    'Abu Dhabi Department for Economic Development': 15,
+    'Head Office-Fujairah Municipality': 5,
+    'Masdar': 5,
+    'Sharjah Economic Development Department': 15,
+    'ADAFZ': 10,
+    'ADGM': 30,
+    'Ajman Department of Economic Development': 15,
+    'Ajman Media City Free Zone': 10,
+    'DAFZA': 10,
+    'DCCA': 10,
+    'Department of Economic Development in Abu Dhabi': 15,
+    'Department of Economic Development in Dubai': 15,
+    'DHCC': 10,
+    'Dibba Municipality': 5,
+    'DIFC': 30,
+    'DMCC': 10,
+    'DSO': 10,
+    'Dubai CommerCity': 10,
+    'Dubai Department of Economy & Tourism': 10,
+    'DWTC': 10,
+    'Fujairah Free Zone': 10,
+    'Hamriyah Free Zone Authority': 5,
+    'Dubai South': 5,
+    'Jafza': 10,
+    'KIZAD': 10,
+    'Meydan': 5,
+    'Ras Al Khaimah Department of Economic Development': 15,
+    'Ras Al Khaimah Economic Zone': 15,
+    'Saif Free Zone': 10,
+    'Sharjah Media City': 5,
+    'Sharjah Publishing City Free Zone': 5,
+    'Trakhees Dubai FZ': 10,
+    'TRAKHEES-Department of Planning and Development': 10,
+    'Umm Al Quwain Department of Economic Development': 15,
+    'Umm Al Quwain Free Trade Zone': 5
+}
+
+LEGAL_TYPE_SCORES = {
+    'Branch of a foreign establishment': 20,
+    'Branch of Company Registered in other emirates': 5,
+    'Civil Company': 20,
+    'Companie Branches': 5,
+    'Establishments': 5,
+    'Limited Liability Company': 5,
+    'Single Person Company': 0,
+    'Branch of Company Registered in free zone': 20,
+    'Branch of Foreign Company': 20,
+    'Branch of Local Company': 5,
+    'Company limited by shares': 5,
+    'Cooperative societies': 5,
+    'Free Zone Company': 5,
+    'Free Zone Company Branch': 5,
+    'Free Zone Corporate': 5,
+    'Free Zone Establishment': 5,
+    'GCC Company Branch': 5,
+    'Limited Liability Company - Single Owner(LLC - SO)': 5,
+    'Private Shareholding Company': 20,
+    'Public Shareholding Company': 20
+}
+
+# Formats the registry sources use for their date columns
+DATE_FORMATS = {
+    'est_date': '%Y-%m-%d',
+    'expiry_date': '%Y-%m-%d',
+    'expiry_date_in_date_format': '%Y-%m-%d %H:%M:%S.%f'
+}
+
+STATUS_SCORES = {
+    'Active': 10,
+    'Expired': -50
+}
+
+
+def code_table(scores, unknown_score=0):
+    # Categories of a lookup factor plus a code -> score array. Code len(categories) is the
+    # explicit "unknown" code for values outside the table (including missing values)
+    categories = pd.Index(list(scores))
+    return categories, np.array(list(scores.values()) + [unknown_score], dtype=np.int64)
+
+
+ECONOMIC_ZONE_CATEGORIES, ECONOMIC_ZONE_CODE_SCORES = code_table(ECONOMIC_ZONE_SCORES)
+LEGAL_TYPE_CATEGORIES, LEGAL_TYPE_CODE_SCORES = code_table(LEGAL_TYPE_SCORES)
+STATUS_CATEGORIES, STATUS_CODE_SCORES = code_table(STATUS_SCORES, unknown_score=-50)
+
+WPS_NEUTRAL_VALUES = ['PRIVATE', 'private', 'N', 'N/', 'N/A', 'NA', '']
+
+WPS_NEGATIVE_PATTERNS = [
+    '*SALARY STAMENT,', '*STOP NEW WORK PERMIT - WPS', 'CANCEL COMPANY',
+    '*COMPANY HAVING FINE,', '*TAWTEEN - NEW WP BLOCK,',
+    '*STOPPED FOR EXPIRED LABOUR CARD FOR MORE THAN 6 MONTHS,',
+    '*COMMUNICATION INFO REQUIRED,', '*HIGH RISK COMPANY,',
+    '*TRANSACTION OF LABOUR CARD IS PENDING IN MOL,',
+    '*WORKPERMIT UNDER CANCELLATION MORE THAN ONE MONTH,',
+    '*WORKPERMIT UNDER CANCELLATION MORE THAN SIX MONTHS,',
+    'NO ACTIVE OWNERS;', 'NO AUTHORIZED OWNER;', 'NO ACTIVE ESIGNATURE CARD;',
+    'NO TRADES FOR THE COMPANY;', '*COMPANY BLOCKED FOR LABOUR CAMP REQUIREMENT,',
+    '*COMPANY HAS FINE INSTALLMENTS,', '*STOPPED BY ADPF,',
+    '*INSTALLMENT NOT PAID AT TIME,'
+]
+
+# All negative patterns in one regex. The lookahead makes every start position a match
+# attempt, so flags whose text overlaps are all reported
+WPS_MATCHER = re.compile('(?=(' + '|'.join(re.escape(pattern) for pattern in WPS_NEGATIVE_PATTERNS) + '))')
+
+_WPS_PATTERN_INDEX = {pattern: i for i, pattern in enumerate(WPS_NEGATIVE_PATTERNS)}
+
+# Feature column per negative pattern, e.g. 'wps_salary_stament'
+WPS_FLAG_COLUMNS = ['wps_' + re.sub(r'[^A-Z0-9]+', '_', pattern).strip('_').lower()
+                    for pattern in WPS_NEGATIVE_PATTERNS]
+
+# UAE cell numbers (9715..., or 05 plus 8 digits) score 5, other UAE numbers (971..., 0...)
+# are treated as landlines, anything else as international
+PHONE_TYPES = ['missing', 'cell', 'landline', 'international']
+PHONE_TYPE_SCORES = np.array([0, 5, 20, 5], dtype=np.int64)
+
+# Columns of contact_features that score_companies can append to its output
+CONTACT_FEATURE_COLUMNS = ['phone_normalized', 'phone_type', 'email_domain']
+
+PUBLIC_EMAIL_DOMAINS = frozenset(['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com'])
+
+EMAIL_REGEX = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
+
+
+def _column(df, name, default):
+    # Vectorized counterpart of row.get(name, default)
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _as_text(values):
+    # str(value) for every entry; missing values become 'nan' like str(np.nan)
+    return values.astype(str).fillna('nan')
+
+
+def _is_blank(values):
+    # pd.isnull(value) or str(value).strip() == ''
+    if pd.api.types.is_numeric_dtype(values):
+        return values.isna()
+    return values.isna() | values.astype(str).str.strip().eq('').fillna(True)
+
+
+def _as_float(values):
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+def encode_categories(values, categories):
+    # Integer codes of values against a fixed category table; unknown -> len(categories)
+    codes = pd.Categorical(values, categories=categories).codes.astype(np.int64)
+    codes[codes < 0] = len(categories)
+    return codes
+
+
+def score_economic_zone(economic_zone):
+    return ECONOMIC_ZONE_CODE_SCORES.take(encode_categories(economic_zone, ECONOMIC_ZONE_CATEGORIES))
+
+
+def parse_dates(values, date_format='%Y-%m-%d'):
+    # One vectorized parse with an explicit format. Values in any other format (the odd
+    # '04/11/2021' in 3k_extended.csv) are retried with per-value inference, which is what
+    # pd.to_datetime does on a single scalar
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed = parsed.where(~retry, pd.to_datetime(values[retry], errors='coerce', format='mixed'))
+    return parsed
+
+
+def parse_date_columns(df):
+    # Parses the DATE_FORMATS columns of a freshly loaded source once, so scoring and the apps
+    # get datetime64 columns. A column is left as is if some value cannot be parsed at all
+    df = df.copy()
+    for column, date_format in DATE_FORMATS.items():
+        if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            parsed = parse_dates(df[column], date_format)
+            if not (parsed.isna() & df[column].notna()).any():
+                df[column] = parsed
+    return df
+
+
+def score_date_of_operations(est_date, expiry_date):
+    years_of_operation = (parse_dates(expiry_date) - parse_dates(est_date)).dt.days.to_numpy(dtype=float) / 365.25
+    scores = np.zeros(len(years_of_operation), dtype=np.int64)
+    scores[(years_of_operation >= 1) & (years_of_operation <= 3)] = 5
+    scores[years_of_operation > 3] = 15
+    return scores
+
+
+def score_status(status):
+    return STATUS_CODE_SCORES.take(encode_categories(status, STATUS_CATEGORIES))
+
+
+def score_legal_type(legal_type):
+    return LEGAL_TYPE_CODE_SCORES.take(encode_categories(legal_type, LEGAL_TYPE_CATEGORIES))
+
+
+def count_unknown_categories(df):
+    # Rows per lookup factor whose value is not in its code table
+    tables = {
+        'economic_department': ECONOMIC_ZONE_CATEGORIES,
+        'legal_type': LEGAL_TYPE_CATEGORIES,
+        'status': STATUS_CATEGORIES
+    }
+    return {column: int((encode_categories(_column(df, column, None), categories) == len(categories)).sum())
+            for column, categories in tables.items()}
+
+
+@functools.lru_cache(maxsize=65536)
+def _match_wps_value(wps_status):
+    # Indices of the negative patterns found in one upper-cased WPS string. WPS values
+    # repeat a lot, so this is memoized across calls (and across streamed chunks)
+    return tuple(sorted({_WPS_PATTERN_INDEX[match.group(1)] for match in WPS_MATCHER.finditer(wps_status)}))
+
+
+def _match_wps(wps_status):
+    # Matches each distinct WPS value once: returns per-row codes into the distinct values,
+    # the distinct values and their (n_distinct x n_patterns) flag matrix
+    codes, uniques = pd.factorize(_as_text(wps_status).str.upper())
+    flags = np.zeros((len(uniques), len(WPS_NEGATIVE_PATTERNS)), dtype=bool)
+    for i, value in enumerate(uniques):
+        flags[i, list(_match_wps_value(value))] = True
+    return codes, np.asarray(uniques, dtype=object), flags
+
+
+def score_wps(wps_status):
+    codes, uniques, flags = _match_wps(wps_status)
+    neutral = np.isin(uniques, WPS_NEUTRAL_VALUES)
+    unique_scores = np.where(neutral, 10, np.where(flags.any(axis=1), -10, 0)).astype(np.int64)
+    return unique_scores.take(codes)
+
+
+def wps_flags(wps_status):
+    # One boolean feature column per negative WPS pattern (see WPS_FLAG_COLUMNS)
+    codes, _, flags = _match_wps(wps_status)
+    return pd.DataFrame(flags.take(codes, axis=0), columns=WPS_FLAG_COLUMNS, index=wps_status.index)
+
+
+def score_visa_ratio(visa_approved, visa_cancelled, visa_requested, visa_used):
+    approved = _as_float(visa_approved)
+    cancelled = _as_float(visa_cancelled)
+    requested = _as_float(visa_requested)
+    used = _as_float(visa_used)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_visas = approved + cancelled
+        cancellation_ratio = cancelled / total_visas
+        unused_ratio = np.where(approved > 0, (approved - used) / approved, 0)
+        request_approval_ratio = np.where(approved > 0, requested / approved, np.inf)
+        usage_ratio = used / approved
+
+    visa_score = np.zeros(len(approved), dtype=np.int64)
+    visa_score -= 15 * (cancellation_ratio > 0.3)
+    visa_score -= 10 * (unused_ratio > 0.5)
+    visa_score -= 5 * (request_approval_ratio > 2)
+    visa_score += 10 * ((approved > 50) & (usage_ratio > 0.8))
+    return np.where(total_visas > 0, visa_score, 0)
+
+
+def score_visa_number(visa_approved, visa_cancelled):
+    visa_number = _as_float(visa_approved) + _as_float(visa_cancelled)
+    # NaN compares False everywhere, which gives the NA case its 0
+    return np.where(visa_number > 50, 20, np.where(visa_number > 0, 10, 0)).astype(np.int64)
+
+
+def coalesce_phone(phone_no, mobile_no):
+    # Falls back to mobile_no wherever phone_no is missing or blank
+    phone_number = phone_no.astype(object).where(~_is_blank(phone_no))
+    return phone_number.where(phone_number.notna(), mobile_no.astype(object).where(~_is_blank(mobile_no)))
+
+
+def normalize_phone(phone_number):
+    # Digits-only form of each number ('' when missing), computed once per distinct value:
+    # drop a float's '.0' tail, then every non-digit character
+    codes, uniques = pd.factorize(phone_number)
+    normalized = pd.Series(uniques, dtype=object).astype(str).str.split('.', n=1).str[0]
+    normalized = normalized.str.replace(r'\D', '', regex=True).to_numpy(dtype=object)
+    normalized = np.append(normalized, '')  # code -1 (missing) picks this
+    return pd.Series(normalized.take(codes), index=phone_number.index, dtype=object)
+
+
+def classify_phone(normalized):
+    # Codes into PHONE_TYPES for digits-only numbers from normalize_phone
+    normalized = normalized.astype(str)
+    cell = normalized.str.startswith('9715') | (normalized.str.startswith('05') & normalized.str.len().eq(10))
+    landline = normalized.str.startswith('971') | normalized.str.startswith('0')
+
+    codes = np.full(len(normalized), PHONE_TYPES.index('international'), dtype=np.int64)
+    codes[landline.to_numpy(dtype=bool)] = PHONE_TYPES.index('landline')
+    codes[cell.to_numpy(dtype=bool)] = PHONE_TYPES.index('cell')
+    codes[normalized.eq('').to_numpy(dtype=bool)] = PHONE_TYPES.index('missing')
+    return codes
+
+
+def score_phone(phone_number):
+    return PHONE_TYPE_SCORES.take(classify_phone(normalize_phone(phone_number)))
+
+
+def contact_features(df):
+    # Normalized contact columns shared by the contact-based factors
+    phone_number = coalesce_phone(_column(df, 'phone_no', None), _column(df, 'mobile_no', None))
+    phone_normalized = normalize_phone(phone_number)
+    return pd.DataFrame({
+        'phone_normalized': phone_normalized,
+        'phone_type': pd.Categorical.from_codes(classify_phone(phone_normalized), categories=PHONE_TYPES),
+        'email_domain': email_domain(_column(df, 'email', ''))
+    }, index=df.index)
+
+
+def score_website(website):
+    return np.where(_is_blank(website).to_numpy(dtype=bool), 0, 10).astype(np.int64)
+
+
+def _distinct_emails(email):
+    # Per-row codes into the distinct values of str(email).lower().strip(), cleaned in Python once
+    # per distinct value: Arrow's string kernels (case mapping, and \w matching only ASCII) do not
+    # agree with the str methods and re used by the row-wise scorer outside ASCII
+    codes, uniques = pd.factorize(_as_text(email))
+    return codes, np.array([value.lower().strip() for value in uniques], dtype=object)
+
+
+def _clean_email(email):
+    # str(email).lower().strip(), plus the missing-or-blank mask
+    codes, uniques = _distinct_emails(email)
+    missing = email.isna().to_numpy(dtype=bool) | (uniques == '').take(codes)
+    return pd.Series(uniques.take(codes), index=email.index, dtype=object), missing
+
+
+def email_domain(email):
+    # Text after the last '@' of the cleaned address ('' when there is none or it is missing).
+    # An address ends with '@' + domain exactly when this equals domain
+    email, missing = _clean_email(email)
+    domain = email.str.rpartition('@')[2].where(email.str.contains('@', regex=False), '')
+    return domain.where(~missing, '')
+
+
+def score_email(email):
+    codes, uniques = _distinct_emails(email)
+    missing = email.isna().to_numpy(dtype=bool) | (uniques == '').take(codes)
+    public = email_domain(email).isin(PUBLIC_EMAIL_DOMAINS).to_numpy(dtype=bool)
+    valid = np.array([EMAIL_REGEX.match(value) is not None for value in uniques], dtype=bool).take(codes)
+
+    scores = np.where(public, -5, np.where(valid, 5, 0))
+    return np.where(missing, -10, scores).astype(np.int64)
+
+
+def score_branch(is_branch):
+    return np.where(_as_text(is_branch).str.lower().eq('yes').to_numpy(dtype=bool), 5, 0).astype(np.int64)
+
+
+def _phone_number(df):
+    return coalesce_phone(_column(df, 'phone_no', None), _column(df, 'mobile_no', None))
+
+
+# Raw (unweighted) score of one factor for every row of a registry frame, keyed by factor name
+FACTOR_SCORERS = {
+    'Economic Zone': lambda df: score_economic_zone(_column(df, 'economic_department', '')),
+    'Date of Operations': lambda df: score_date_of_operations(_column(df, 'est_date', None),
+                                                              _column(df, 'expiry_date', None)),
+    'Status': lambda df: score_status(_column(df, 'status', '')),
+    'Legal Type': lambda df: score_legal_type(_column(df, 'legal_type', '')),
+    'WPS': lambda df: score_wps(_column(df, 'wps', '')),
+    'Visa Number': lambda df: score_visa_number(_column(df, 'visa_approved', 0), _column(df, 'visa_cancelled', 0)),
+    'Visa Ratio': lambda df: score_visa_ratio(_column(df, 'visa_approved', 0), _column(df, 'visa_cancelled', 0),
+                                              _column(df, 'visa_requested', 0), _column(df, 'visa_used', 0)),
+    'Phone': lambda df: score_phone(_phone_number(df)),
+    'Website': lambda df: score_website(_column(df, 'website', '')),
+    'Email': lambda df: score_email(_column(df, 'email', '')),
+    'Branch': lambda df: score_branch(_column(df, 'is_branch', ''))
+}
+
+
+def raw_factor_scores(df):
+    # Raw (unweighted) score per factor, keyed by factor name. Timed apart from the row path's
+    # factors, one call covering every row of df
+    return {factor: time_factor(f"{factor} (vectorized)", score, df) for factor, score in FACTOR_SCORERS.items()}
+
+
+def factor_matrix(df):
+    # N x 11 float matrix of raw scores, one column per entry of FACTORS. Computed once,
+    # it can be re-weighted with apply_weights without touching the source columns again
+    raw = raw_factor_scores(df)
+    return np.column_stack([raw[factor] for factor in FACTORS]).astype(float)
+
+
+def weight_vector(weights):
+    return np.array([weights[factor] for factor in FACTORS], dtype=float)
+
+
+def apply_weights(matrix, weights):
+    # Weighted total for every company with a single matrix-vector product
+    return matrix @ weight_vector(weights)
+
+
+def feature_columns(include_wps_flags=False, include_contact_features=False):
+    # Names of the feature columns score_companies appends with these options, in order
+    columns = WPS_FLAG_COLUMNS if include_wps_flags else []
+    return columns + (CONTACT_FEATURE_COLUMNS if include_contact_features else [])
+
+
+def score_companies(df, weights=None, matrix=None, include_wps_flags=False, include_contact_features=False):
+    # DataFrame in, DataFrame out: the same 24 columns calculate_risk_score returns per row,
+    # aligned on df's index. A precomputed factor_matrix(df) can be passed in to skip rescoring;
+    # include_wps_flags appends the WPS_FLAG_COLUMNS features and include_contact_features the
+    # CONTACT_FEATURE_COLUMNS of contact_features
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+    if matrix is None:
+        matrix = factor_matrix(df)
+
+    scores = {}
+    total_raw = np.zeros(len(matrix), dtype=np.int64)
+    total_weight_adjusted = np.zeros(len(matrix), dtype=float)
+    # Totals are accumulated factor by factor (not via apply_weights) so they match the
+    # row-wise sum() bit for bit
+    for i, factor in enumerate(FACTORS):
+        scores[factor + '_raw'] = matrix[:, i].astype(np.int64)
+        scores[factor] = scores[factor + '_raw'] * weights[factor]
+        total_raw = total_raw + scores[factor + '_raw']
+        total_weight_adjusted = total_weight_adjusted + scores[factor]
+    scores['Total_raw'] = total_raw
+    scores['Total_weight_adjusted'] = total_weight_adjusted
+
+    result = pd.DataFrame({column: scores[column] for column in SCORE_COLUMNS}, index=df.index)
+    if include_wps_flags:
+        result = pd.concat([result, wps_flags(_column(df, 'wps', ''))], axis=1)
+    if include_contact_features:
+        result = pd.concat([result, contact_features(df)[CONTACT_FEATURE_COLUMNS]], axis=1)
+    return result
+
+
+def top_k(df, scores, k, largest=True, tie_breaker='company_id'):
+    # The k rows of df with the highest (largest=False: lowest) scores, best first, selected
+    # with argpartition instead of sorting the whole frame. Ties are ordered by the
+    # tie_breaker column (ascending, missing last) and then by row position; NaN scores rank last
+    scores = np.asarray(scores, dtype=float)
+    k = min(k, len(scores))
+    if k <= 0:
+        return df.iloc[[]]
+
+    key = -scores if largest else scores.copy()
+    key[np.isnan(key)] = np.inf
+    threshold = key[np.argpartition(key, k - 1)[:k]].max()
+    # Everything tied with the k-th score stays a candidate so the tie-break is exact
+    candidates = np.flatnonzero(key <= threshold)
+
+    if tie_breaker in df.columns:
+        tie_codes, _ = pd.factorize(df[tie_breaker].iloc[candidates], sort=True)
+        tie_codes = np.where(tie_codes < 0, len(candidates), tie_codes)
+    else:
+        tie_codes = np.zeros(len(candidates), dtype=np.int64)
+    order = np.lexsort((candidates, tie_codes, key[candidates]))
+    return df.iloc[candidates[order[:k]]]
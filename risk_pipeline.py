@@ -0,0 +1,347 @@
+import contextlib
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from registry import company_key_hashes, company_keys, dedup_rows
+from risk_engine import (FACTORS, ECONOMIC_ZONE_CATEGORIES, ECONOMIC_ZONE_CODE_SCORES, LEGAL_TYPE_CATEGORIES,
+                         LEGAL_TYPE_CODE_SCORES, STATUS_CATEGORIES, STATUS_CODE_SCORES, _column, coalesce_phone,
+                         encode_categories, factor_matrix, parse_dates, score_branch, score_companies,
+                         score_date_of_operations, score_email, score_phone, score_visa_number, score_visa_ratio,
+                         score_website, score_wps, top_k)
+
+
+# Batch scoring modes for registries too large for a single in-memory pass.
+#
+# Streaming: sources are read in fixed-size chunks, each chunk is scored and handed to a
+# writer, and only a running top-N survives between chunks, so peak memory depends on the
+# chunk size rather than on the size of the registry.
+#
+# Incremental: raw factor scores are persisted per company together with a fingerprint of
+# its scoring inputs; later runs rescore only new and changed companies.
+#
+# Parallel: the frame is split into one large contiguous slice per worker. Numeric, date and
+# category-code columns are placed in shared memory once; each worker scores its slice and
+# writes raw factor scores straight into a shared N x 11 result matrix.
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+# pandas' default na_values, which pd.read_excel applies but openpyxl's row iterator does not
+EXCEL_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+                   'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+
+def _iter_excel_chunks(path, chunk_size, columns=None):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = list(next(rows))
+        while True:
+            batch = list(itertools.islice(rows, chunk_size))
+            if not batch:
+                break
+            chunk = pd.DataFrame(batch, columns=header)
+            chunk = chunk.mask(chunk.isin(EXCEL_NA_VALUES)).infer_objects()
+            yield chunk[[column for column in columns if column in header]] if columns is not None else chunk
+    finally:
+        workbook.close()
+
+
+def _iter_parquet_chunks(path, chunk_size, columns=None):
+    import pyarrow.parquet as pq
+
+    source = pq.ParquetFile(path)
+    if columns is not None:
+        columns = [column for column in columns if column in source.schema_arrow.names]
+    for batch in source.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def iter_source_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, columns=None):
+    # DataFrames of at most chunk_size rows from a CSV, Excel or Parquet source. Columns the
+    # source does not have are skipped
+    if path.lower().endswith(('.xlsx', '.xls')):
+        yield from _iter_excel_chunks(path, chunk_size, columns)
+    elif path.lower().endswith(('.parquet', '.pq')):
+        yield from _iter_parquet_chunks(path, chunk_size, columns)
+    else:
+        usecols = None if columns is None else lambda column: column in columns
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=usecols)
+
+
+def source_header(path):
+    # Column names of a CSV, Excel or Parquet source, read from its header alone. Streaming runs
+    # use this rather than registry.registry_columns, which may parse the whole source to build
+    # its snapshot
+    if path.lower().endswith(('.xlsx', '.xls')):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            return list(next(workbook.active.iter_rows(values_only=True), ()))
+        finally:
+            workbook.close()
+    if path.lower().endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).schema_arrow.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def stream_columns(paths):
+    # Column names across the sources, in source order, as registry.registry_columns
+    return list(dict.fromkeys(column for path in paths for column in source_header(path)))
+
+
+def count_source_rows(path):
+    # Data rows of a CSV, Excel or Parquet source without loading it, for progress reporting.
+    # None when an Excel sheet does not record its size
+    if path.lower().endswith(('.xlsx', '.xls')):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+        return None if max_row is None else max(max_row - 1, 0)
+    if path.lower().endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).metadata.num_rows
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=[0], chunksize=DEFAULT_CHUNK_SIZE))
+
+
+def dedup_plan(paths, chunk_size=DEFAULT_CHUNK_SIZE, precedence=None):
+    # registry.dedup_rows over the concatenated sources, from a first pass that reads only
+    # their id columns. Keys are kept as 64-bit hashes, so the plan holds a few numeric arrays
+    # of the registry's length rather than a string per row
+    hashes = [np.array([], dtype=np.uint64)]
+    anonymous = [np.array([], dtype=bool)]
+    source_index = [np.array([], dtype=int)]
+    for position, path in enumerate(paths):
+        for chunk in iter_source_chunks(path, chunk_size, columns=['company_id', 'bl_local_no']):
+            chunk_hashes, chunk_anonymous = company_key_hashes(chunk)
+            hashes.append(chunk_hashes)
+            anonymous.append(chunk_anonymous)
+            source_index.append(np.full(len(chunk), position))
+    return dedup_rows(np.concatenate(hashes), np.concatenate(source_index), list(paths), precedence,
+                      anonymous=np.concatenate(anonymous))
+
+
+def iter_registry_chunks(paths, chunk_size=DEFAULT_CHUNK_SIZE, columns=None, dedup=False, precedence=None):
+    # Chunks of all sources back to back, indexed by global row number as in
+    # pd.concat(..., ignore_index=True). With dedup, rows are filtered and given provenance
+    # exactly as registry.load_registry does, at the cost of a first pass over the id columns
+    keep = sources = None
+    if dedup:
+        keep, sources = dedup_plan(paths, chunk_size, precedence)
+
+    start = 0
+    for path in paths:
+        for chunk in iter_source_chunks(path, chunk_size, columns):
+            stop = start + len(chunk)
+            chunk.index = pd.RangeIndex(start, stop)
+            if dedup:
+                chunk['source'] = path
+                chunk['sources'] = sources[start:stop]
+                chunk = chunk[keep[start:stop]]
+            start = stop
+            if not (dedup and chunk.empty):
+                yield chunk
+
+
+def score_stream(chunks, writer, top_n=100, weights=None, sort_column='Total_weight_adjusted', n_workers=1,
+                 columns=None, include_wps_flags=False, include_contact_features=False):
+    # Scores each chunk, writes it in input order and returns the top_n rows by sort_column
+    # (highest first) across everything seen. n_workers > 1 scores each chunk with score_parallel,
+    # on one process pool started for the whole stream. include_wps_flags and
+    # include_contact_features are passed on to score_companies.
+    # columns, when given, is the output's column order; chunks lacking some of them (sources
+    # without those columns) get them empty
+    top = None
+    rows = 0
+    with ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else contextlib.nullcontext() as pool:
+        for chunk in chunks:
+            if pool is not None:
+                scores = score_parallel(chunk, n_workers, weights, include_wps_flags=include_wps_flags,
+                                        include_contact_features=include_contact_features, pool=pool)
+            else:
+                scores = score_companies(chunk, weights, include_wps_flags=include_wps_flags,
+                                         include_contact_features=include_contact_features)
+            scored = pd.concat([chunk, scores], axis=1)
+            if columns is not None:
+                scored = scored.reindex(columns=columns)
+            writer.write(scored)
+            rows += len(scored)
+
+            candidates = scored if top is None else pd.concat([top, scored])
+            top = top_k(candidates, candidates[sort_column], top_n)
+
+    if top is None:
+        return pd.DataFrame(), rows
+    return top, rows
+
+
+VISA_COLUMNS = ['visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used']
+
+# Columns with no numeric encoding; each worker receives only its own slice of them
+TEXT_COLUMNS = ['wps', 'phone_no', 'mobile_no', 'website', 'email', 'is_branch']
+
+
+def _shared_array(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _score_slice(specs, start, stop, text):
+    # Worker side: raw factor scores for rows [start, stop) written into the shared result
+    handles = []
+    try:
+        arrays = {}
+        for key, spec in specs.items():
+            shm, arrays[key] = _attach(spec)
+            handles.append(shm)
+        visa = [pd.Series(arrays['visa'][start:stop, i]) for i in range(len(VISA_COLUMNS))]
+        dates = arrays['dates'][start:stop].view('M8[ns]')
+        codes = arrays['codes'][start:stop]
+        text = text.reset_index(drop=True)
+
+        raw = {
+            'Economic Zone': ECONOMIC_ZONE_CODE_SCORES.take(codes[:, 0]),
+            'Date of Operations': score_date_of_operations(pd.Series(dates[:, 0]), pd.Series(dates[:, 1])),
+            'Status': STATUS_CODE_SCORES.take(codes[:, 1]),
+            'Legal Type': LEGAL_TYPE_CODE_SCORES.take(codes[:, 2]),
+            'WPS': score_wps(text['wps']),
+            'Visa Number': score_visa_number(visa[0], visa[1]),
+            'Visa Ratio': score_visa_ratio(*visa),
+            'Phone': score_phone(coalesce_phone(text['phone_no'], text['mobile_no'])),
+            'Website': score_website(text['website']),
+            'Email': score_email(text['email']),
+            'Branch': score_branch(text['is_branch'])
+        }
+        result = arrays['result']
+        for i, factor in enumerate(FACTORS):
+            result[start:stop, i] = raw[factor]
+        return stop - start
+    finally:
+        for shm in handles:
+            shm.close()
+
+
+def parallel_factor_matrix(df, n_workers=None, pool=None):
+    # Same N x 11 matrix as risk_engine.factor_matrix(df), computed by a process pool over
+    # n_workers contiguous slices. pool, when given, is used instead of starting one, so that
+    # scoring many chunks pays for the worker processes once
+    n_workers = n_workers or os.cpu_count() or 1
+    n_rows = len(df)
+
+    visa = np.column_stack([pd.to_numeric(_column(df, column, 0), errors='coerce').to_numpy(dtype=float)
+                            for column in VISA_COLUMNS])
+    dates = np.column_stack([parse_dates(_column(df, column, None)).to_numpy(dtype='M8[ns]').view(np.int64)
+                             for column in ['est_date', 'expiry_date']])
+    codes = np.column_stack([encode_categories(_column(df, 'economic_department', ''), ECONOMIC_ZONE_CATEGORIES),
+                             encode_categories(_column(df, 'status', ''), STATUS_CATEGORIES),
+                             encode_categories(_column(df, 'legal_type', ''), LEGAL_TYPE_CATEGORIES)])
+    defaults = {'phone_no': None, 'mobile_no': None}
+    text = pd.DataFrame({column: _column(df, column, defaults.get(column, '')) for column in TEXT_COLUMNS},
+                        index=df.index)
+
+    shared = [_shared_array(visa), _shared_array(dates), _shared_array(codes),
+              _shared_array(np.zeros((n_rows, len(FACTORS)), dtype=float))]
+    specs = dict(zip(['visa', 'dates', 'codes', 'result'], [spec for _, spec in shared]))
+    try:
+        bounds = np.linspace(0, n_rows, n_workers + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=n_workers) if pool is None else contextlib.nullcontext(pool) as pool:
+            futures = [pool.submit(_score_slice, specs, start, stop, text.iloc[start:stop])
+                       for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            for future in futures:
+                future.result()
+        result_shm = shared[-1][0]
+        return np.ndarray((n_rows, len(FACTORS)), dtype=float, buffer=result_shm.buf).copy()
+    finally:
+        for shm, _ in shared:
+            shm.close()
+            shm.unlink()
+
+
+def score_parallel(df, n_workers=None, weights=None, include_wps_flags=False, include_contact_features=False,
+                   pool=None):
+    # Parallel counterpart of risk_engine.score_companies(df, weights, ...), on pool if given
+    return score_companies(df, weights, matrix=parallel_factor_matrix(df, n_workers, pool),
+                           include_wps_flags=include_wps_flags, include_contact_features=include_contact_features)
+
+
+# Persisted raw factor scores and input fingerprints for incremental runs
+STATE_PATH = './data/.scores/company_factor_scores.parquet'
+
+# Every column a factor score depends on
+SCORING_COLUMNS = ['economic_department', 'est_date', 'expiry_date', 'status', 'legal_type', 'wps',
+                   'visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used', 'phone_no', 'mobile_no',
+                   'website', 'email', 'is_branch']
+
+
+def row_keys(df):
+    # company_keys made unique per row: repeated keys get '#2', '#3'... in input order
+    keys = company_keys(df)
+    occurrence = keys.groupby(keys, sort=False).cumcount()
+    return keys.where(occurrence == 0, keys + '#' + (occurrence + 1).astype(str))
+
+
+def row_fingerprints(df):
+    # 64-bit hash of each row's scoring inputs. A column whose inferred dtype changes between
+    # drops hashes differently, which only costs a rescore of those rows
+    columns = [column for column in SCORING_COLUMNS if column in df.columns]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy(dtype=np.uint64)
+
+
+def incremental_factor_matrix(df, state_path=STATE_PATH):
+    # Same matrix as risk_engine.factor_matrix(df), reusing the stored scores of companies whose
+    # inputs did not change since the last run. Updates the stored state (dropping companies
+    # no longer in df) and returns the matrix with counts of unchanged/changed/new/deleted rows
+    keys = row_keys(df).to_numpy(dtype=object)
+    fingerprints = row_fingerprints(df)
+
+    if os.path.exists(state_path):
+        state = pd.read_parquet(state_path).set_index('key')
+    else:
+        state = pd.DataFrame(columns=['fingerprint'] + FACTORS, index=pd.Index([], name='key'))
+
+    positions = state.index.get_indexer(keys)
+    known = positions >= 0
+    stored_fingerprints = state['fingerprint'].to_numpy(dtype=np.uint64)
+    unchanged = known.copy()
+    unchanged[known] = stored_fingerprints[positions[known]] == fingerprints[known]
+
+    matrix = np.empty((len(df), len(FACTORS)), dtype=float)
+    matrix[unchanged] = state[FACTORS].to_numpy(dtype=float)[positions[unchanged]]
+    if not unchanged.all():
+        matrix[~unchanged] = factor_matrix(df[~unchanged])
+
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    new_state = pd.DataFrame(matrix, columns=FACTORS)
+    new_state.insert(0, 'fingerprint', fingerprints)
+    new_state.insert(0, 'key', keys)
+    new_state.to_parquet(state_path + '.tmp', index=False)
+    os.replace(state_path + '.tmp', state_path)
+
+    counts = {
+        'unchanged': int(unchanged.sum()),
+        'changed': int((known & ~unchanged).sum()),
+        'new': int((~known).sum()),
+        'deleted': int(len(state) - len(np.unique(positions[known])))
+    }
+    return matrix, counts
@@ -0,0 +1,149 @@
+import os
+
+from risk_engine import SCORE_COLUMNS
+
+
+# Output sinks for scored companies. A writer receives the result one DataFrame chunk at a
+# time through write() and is finalised with close(), so callers never need the whole
+# scored registry in memory. open_writer picks the writer for a path or an explicit format.
+
+# Identifying columns kept when only the scores are written
+ID_COLUMNS = ['company_id', 'bl_local_no', 'business_name_english']
+
+# Rows per worksheet, Excel's limit minus the header row
+XLSX_MAX_ROWS = 1_048_575
+
+
+class ResultWriter:
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.columns = columns
+        self._output_columns = None
+        if os.path.exists(path):
+            os.remove(path)
+
+    def write(self, df):
+        if self.columns is not None:
+            df = df[[column for column in self.columns if column in df.columns]]
+        # The first chunk fixes the output's columns; later chunks are matched to them by name,
+        # not position, since sources may list their columns in different orders
+        if self._output_columns is None:
+            self._output_columns = list(df.columns)
+        else:
+            unexpected = [column for column in df.columns if column not in self._output_columns]
+            if unexpected:
+                raise ValueError(f"Chunk has columns missing from the output header: {unexpected}")
+            df = df.reindex(columns=self._output_columns)
+        self._write(df)
+
+    def _write(self, df):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvWriter(ResultWriter):
+    def __init__(self, path, columns=None):
+        super().__init__(path, columns)
+        self._header_written = False
+
+    def _write(self, df):
+        df.to_csv(self.path, mode='a', header=not self._header_written, index=False)
+        self._header_written = True
+
+
+class ParquetWriter(ResultWriter):
+    # One row group per chunk. Score columns keep their numeric types; input columns are
+    # stored as text, since chunks from different sources disagree on their inferred types
+    # (int vs float ids, parsed vs raw dates, all-empty columns) and every row group must
+    # share the schema of the first one
+    def __init__(self, path, columns=None):
+        super().__init__(path, columns)
+        self._writer = None
+
+    def _write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        df = df.copy()
+        for column in df.columns:
+            if column not in SCORE_COLUMNS:
+                values = df[column]
+                df[column] = values.astype(str).astype(object).where(values.notna(), None)
+
+        fields = [pa.field(str(column), pa.string()) if column not in SCORE_COLUMNS
+                  else pa.field(column, pa.from_numpy_dtype(df[column].dtype)) for column in df.columns]
+        table = pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class XlsxWriter(ResultWriter):
+    # openpyxl write-only workbook: rows are streamed to disk, so memory stays flat however
+    # many rows are written. Continues on a new sheet when one is full
+    def __init__(self, path, columns=None):
+        super().__init__(path, columns)
+        from openpyxl import Workbook
+
+        self._workbook = Workbook(write_only=True)
+        self._sheet = None
+        self._sheet_rows = 0
+        self._header = None
+
+    def _new_sheet(self):
+        self._sheet = self._workbook.create_sheet(f"Sheet{len(self._workbook.worksheets) + 1}")
+        self._sheet.append(self._header)
+        self._sheet_rows = 0
+
+    def _write(self, df):
+        if self._header is None:
+            self._header = [str(column) for column in df.columns]
+            self._new_sheet()
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            if self._sheet_rows == XLSX_MAX_ROWS:
+                self._new_sheet()
+            self._sheet.append(row)
+            self._sheet_rows += 1
+
+    def close(self):
+        if self._workbook is not None:
+            if self._sheet is None:
+                self._workbook.create_sheet('Sheet1')
+            self._workbook.save(self.path)
+            self._workbook = None
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'parquet': ParquetWriter,
+    'xlsx': XlsxWriter
+}
+
+
+def output_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return {'pq': 'parquet', 'xls': 'xlsx'}.get(extension, extension)
+
+
+def open_writer(path, fmt=None, scores_only=False, features=()):
+    # Writer for path, by explicit fmt or by file extension. scores_only keeps ID_COLUMNS,
+    # the score columns and the feature columns named in features, and drops every input column
+    fmt = fmt or output_format(path)
+    if fmt not in WRITERS:
+        raise ValueError(f"Unsupported output format '{fmt}', expected one of {sorted(WRITERS)}")
+    columns = ID_COLUMNS + SCORE_COLUMNS + list(features) if scores_only else None
+    return WRITERS[fmt](path, columns)
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from risk_engine import score_companies
+from risk_pipeline import SCORING_COLUMNS, count_source_rows, iter_source_chunks
+from risk_writers import open_writer
+
+
+# Background scoring of uploaded registry files. A job copies its upload to a temporary
+# directory and runs this script on it in a separate Python process, which scores the file
+# chunk by chunk, appending each scored chunk to a CSV next to it and recording its progress
+# in a small JSON file that the page polls. Scoring thus neither blocks a session nor
+# competes with the server for the GIL. A pool of threads shared by every session of the app
+# waits on the processes, capping how many uploads are scored at once.
+#
+# A job's directory (the upload and its scored CSV) is removed when the job is dropped, i.e.
+# replaced by another upload or its session closed, and otherwise JOB_TTL_SECONDS after the
+# job finished, by a sweep run whenever a job is submitted. The sweep also removes directories
+# left behind by an app process that exited without cleaning up.
+
+UPLOAD_TYPES = ['csv', 'xlsx']
+
+UPLOAD_CHUNK_SIZE = 20_000
+
+# Uploads scored at the same time; later ones wait for a free worker
+MAX_RUNNING_JOBS = 2
+
+# Scheduling priority of the worker processes relative to the app, so the server stays
+# responsive while uploads are scored on the same cores
+WORKER_NICENESS = 10
+
+# Seconds a finished job's scored file stays available for download
+JOB_TTL_SECONDS = 60 * 60
+
+JOB_DIR_PREFIX = 'risk-upload-'
+JOB_FILE = 'job.json'
+PROGRESS_FILE = 'progress.json'
+CANCEL_FILE = 'cancelled'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Jobs of this process still referenced by some session
+_jobs = weakref.WeakSet()
+
+
+def _sweep():
+    # Removes the files of jobs that finished more than JOB_TTL_SECONDS ago, and job directories
+    # of no job of this process untouched for as long (running jobs keep updating theirs)
+    now = time.time()
+    jobs = list(_jobs)
+    for job in jobs:
+        if job.finished is not None and now - job.finished > JOB_TTL_SECONDS:
+            job.discard()
+    live = {job._dir for job in jobs}
+    temp_dir = tempfile.gettempdir()
+    for name in os.listdir(temp_dir):
+        path = os.path.join(temp_dir, name)
+        if not name.startswith(JOB_DIR_PREFIX) or path in live:
+            continue
+        try:
+            expired = now - os.path.getmtime(path) > JOB_TTL_SECONDS
+        except OSError:
+            continue
+        if expired:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_RUNNING_JOBS, thread_name_prefix='scoring-job')
+        _sweep()
+    return _pool
+
+
+def upload_frame(chunk):
+    # The registry names the website column website_url, the engine reads website
+    if 'website' not in chunk.columns and 'website_url' in chunk.columns:
+        chunk = chunk.rename(columns={'website_url': 'website'})
+    return chunk
+
+
+def _write_progress(job_dir, progress):
+    path = os.path.join(job_dir, PROGRESS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(progress, f)
+    os.replace(path + '.tmp', path)
+
+
+def score_file(job_dir):
+    # Worker side: scores the upload described by job_dir/JOB_FILE into its result file,
+    # stopping early once the job is cancelled. Returns the number of rows scored
+    with open(os.path.join(job_dir, JOB_FILE)) as f:
+        job = json.load(f)
+    progress = {'rows': 0, 'total_rows': None, 'started': time.time()}
+    _write_progress(job_dir, progress)
+    source_path = os.path.join(job_dir, job['name'])
+    progress['total_rows'] = count_source_rows(source_path)
+    _write_progress(job_dir, progress)
+
+    with open_writer(os.path.join(job_dir, job['result_name']), 'csv') as writer:
+        for chunk in iter_source_chunks(source_path, job['chunk_size']):
+            if os.path.exists(os.path.join(job_dir, CANCEL_FILE)):
+                break
+            chunk = upload_frame(chunk)
+            if not any(column in chunk.columns for column in SCORING_COLUMNS):
+                raise ValueError(f"'{job['name']}' has none of the registry columns used for scoring")
+            writer.write(pd.concat([chunk, score_companies(chunk, job['weights'])], axis=1))
+            progress['rows'] += len(chunk)
+            _write_progress(job_dir, progress)
+    return progress['rows']
+
+
+def _run_worker(job_dir):
+    # Pool side: runs score_file in its own process; a failure is raised with the worker's
+    # last error line
+    worker = subprocess.run([sys.executable, os.path.abspath(__file__), job_dir], capture_output=True, text=True)
+    if worker.returncode != 0:
+        lines = worker.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"Scoring worker exited with code {worker.returncode}")
+
+
+class ScoringJob:
+    def __init__(self, name, data, weights, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.name = os.path.basename(name)
+        self.result_name = f"{os.path.splitext(self.name)[0]}_scored.csv"
+        self.finished = None
+        self._dir = tempfile.mkdtemp(prefix=JOB_DIR_PREFIX)
+        # Removes the directory once the job is garbage collected, at the latest on exit
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self._dir, ignore_errors=True)
+        with open(os.path.join(self._dir, self.name), 'wb') as f:
+            f.write(data)
+        with open(os.path.join(self._dir, JOB_FILE), 'w') as f:
+            json.dump({'name': self.name, 'result_name': self.result_name, 'weights': dict(weights),
+                       'chunk_size': chunk_size}, f)
+        self._future = _executor().submit(_run_worker, self._dir)
+        self._future.add_done_callback(self._on_done)
+        _jobs.add(self)
+
+    def _on_done(self, future):
+        self.finished = time.time()
+
+    def _progress(self):
+        try:
+            with open(os.path.join(self._dir, PROGRESS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def state(self):
+        # queued, running, done, failed, cancelled or expired (its files removed)
+        if not self._cleanup.alive:
+            return 'expired'
+        if os.path.exists(os.path.join(self._dir, CANCEL_FILE)) or self._future.cancelled():
+            return 'cancelled'
+        if not self._future.done():
+            return 'queued' if self._progress() is None else 'running'
+        return 'failed' if self._future.exception() is not None else 'done'
+
+    @property
+    def active(self):
+        return not self._future.done()
+
+    @property
+    def error(self):
+        return self._future.exception() if self._future.done() and not self._future.cancelled() else None
+
+    @property
+    def progress(self):
+        # Rows scored so far, rows in the file (None while counting or when unknown) and seconds
+        # since scoring started
+        progress = self._progress()
+        if progress is None:
+            return 0, None, 0.0
+        return progress['rows'], progress['total_rows'], (self.finished or time.time()) - progress['started']
+
+    def cancel(self):
+        if self.active:
+            open(os.path.join(self._dir, CANCEL_FILE), 'w').close()
+            self._future.cancel()
+
+    def result(self):
+        # The scored CSV, read only when it is downloaded
+        with open(os.path.join(self._dir, self.result_name), 'rb') as f:
+            return f.read()
+
+    def discard(self):
+        self.cancel()
+        self._cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score an uploaded registry file (run by ScoringJob).")
+    parser.add_argument('job_dir', help=f"Job directory holding the upload and its {JOB_FILE}")
+    args = parser.parse_args(argv)
+    if hasattr(os, 'nice'):
+        os.nice(WORKER_NICENESS)
+    score_file(args.job_dir)
+
+
+if __name__ == '__main__':
+    main()
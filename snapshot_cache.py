@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from risk_engine import parse_date_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # snapshots are an optimisation; without pyarrow every load parses the source
+    pa = None
+    feather = None
+
+
+# Binary columnar snapshots of the registry sources. The first load of a source parses it
+# (openpyxl / CSV) and writes an uncompressed Arrow IPC file next to it; later loads
+# memory-map that file instead. Each snapshot records the size, mtime and SHA-256 of the
+# source it was built from and is rebuilt as soon as the source changes. Date columns are
+# parsed once while building, so the snapshot already holds them as timestamps.
+
+SNAPSHOT_DIR = './data/.snapshots'
+
+# Bump whenever what goes into a snapshot changes, to invalidate existing ones
+SNAPSHOT_VERSION = 2
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def _parse_source(path):
+    if path.lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(path, engine='openpyxl')
+    elif path.lower().endswith(('.parquet', '.pq')):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    return parse_date_columns(df)
+
+
+def _content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _snapshot_paths(path, snapshot_dir):
+    source = os.path.abspath(path)
+    name = f"{os.path.basename(source)}.{hashlib.sha1(source.encode()).hexdigest()[:12]}"
+    base = os.path.join(snapshot_dir, name)
+    return base + '.arrow', base + '.json'
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, write):
+    # Several Streamlit sessions may load at once; never expose a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_meta(meta_path, meta):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+    _write_atomic(meta_path, write)
+
+
+def arrow_safe(df):
+    # Excel columns such as bl_local_no mix ints and strings, which Arrow cannot store in one
+    # column; keep those as strings (missing values stay missing)
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed'):
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def _is_current(path, meta, stat):
+    if meta is None or meta.get('version') != SNAPSHOT_VERSION:
+        return False
+    if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    # Same size but touched (copied, re-synced...): only the content hash can tell
+    return meta['size'] == stat.st_size and meta['sha256'] == _content_hash(path)
+
+
+def _current_snapshot(path, snapshot_dir):
+    # Path of the snapshot for path if it is still valid, else None
+    snapshot_path, meta_path = _snapshot_paths(path, snapshot_dir)
+    stat = os.stat(path)
+    meta = _read_meta(meta_path)
+    if not (os.path.exists(snapshot_path) and _is_current(path, meta, stat)):
+        return None
+    if meta['mtime_ns'] != stat.st_mtime_ns:
+        _write_meta(meta_path, dict(meta, mtime_ns=stat.st_mtime_ns))
+    return snapshot_path
+
+
+def _build_snapshot(path, snapshot_dir):
+    snapshot_path, meta_path = _snapshot_paths(path, snapshot_dir)
+    stat = os.stat(path)
+    df = arrow_safe(_parse_source(path))
+    os.makedirs(snapshot_dir, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    _write_atomic(snapshot_path, lambda tmp_path: feather.write_feather(table, tmp_path, compression='uncompressed'))
+    _write_meta(meta_path, {'version': SNAPSHOT_VERSION, 'source': os.path.abspath(path), 'size': stat.st_size,
+                            'mtime_ns': stat.st_mtime_ns, 'sha256': _content_hash(path)})
+    return df
+
+
+def _select(df, columns, rows):
+    df = df[columns] if columns is not None else df
+    return df.iloc[rows].set_axis(rows) if rows is not None else df
+
+
+def _take(table, rows):
+    # table.take(rows).to_pandas(), with the dtypes of the whole table's conversion: Arrow turns
+    # integer and boolean columns holding nulls into float and object ones, which a subset
+    # without nulls would not become
+    # Taken batch by batch: taking from the whole table first concatenates its batches
+    rows = np.asarray(rows, dtype=np.int64)
+    batches = table.to_batches()
+    offsets = np.cumsum([0] + [batch.num_rows for batch in batches])
+    batch_index = np.searchsorted(offsets, rows, side='right') - 1
+    taken = [batches[i].take(pa.array(rows[batch_index == i] - offsets[i])) for i in np.unique(batch_index)]
+    df = pa.Table.from_batches(taken, schema=table.schema).to_pandas().set_axis(rows)
+    for name, column in zip(table.column_names, table.columns):
+        if column.null_count and pa.types.is_integer(column.type):
+            df[name] = df[name].astype(float)
+        elif column.null_count and pa.types.is_boolean(column.type):
+            df[name] = df[name].astype(object)
+    return df
+
+
+def read_source(path, columns=None, snapshot_dir=SNAPSHOT_DIR, rows=None):
+    # Drop-in for pd.read_excel / pd.read_csv on a registry source, optionally limited to
+    # `columns` and to the row positions `rows` (then indexed by them). Served from the
+    # snapshot when it is still valid for the source; only the requested rows of the
+    # memory-mapped snapshot are then converted to pandas.
+    if feather is None:
+        return _select(_parse_source(path), columns, rows)
+
+    snapshot_path = _current_snapshot(path, snapshot_dir)
+    if snapshot_path is not None:
+        table = feather.read_table(snapshot_path, columns=columns, memory_map=True)
+        return table.to_pandas() if rows is None else _take(table, rows)
+
+    return _select(_build_snapshot(path, snapshot_dir), columns, rows)
+
+
+def source_rows(path, snapshot_dir=SNAPSHOT_DIR):
+    # Number of rows of a source, read from the snapshot's record batches when available
+    if feather is not None:
+        snapshot_path = _current_snapshot(path, snapshot_dir)
+        if snapshot_path is None:
+            return len(_build_snapshot(path, snapshot_dir))
+        with pa.memory_map(snapshot_path) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    return len(_parse_source(path))
+
+
+def source_columns(path, snapshot_dir=SNAPSHOT_DIR):
+    # Column names of a source, read from the snapshot's schema when one is available
+    if feather is not None:
+        snapshot_path = _current_snapshot(path, snapshot_dir)
+        if snapshot_path is None:
+            return list(_build_snapshot(path, snapshot_dir).columns)
+        with pa.memory_map(snapshot_path) as source:
+            return pa.ipc.open_file(source).schema.names
+    return list(_parse_source(path).columns)
+
+
+def source_version(paths):
+    # Cheap key that changes whenever one of the sources does, for caches built from them
+    stats = [os.stat(path) for path in paths]
+    return tuple((path, stat.st_size, stat.st_mtime_ns) for path, stat in zip(paths, stats))
@@ -0,0 +1,376 @@
+import argparse
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from risk_engine import DATE_FORMATS, PUBLIC_EMAIL_DOMAINS, email_domain
+from snapshot_cache import read_source
+
+
+# Synthetic registries with the columns and value distributions of the real sources, for load
+# testing without sharing production extracts. learn_profile() summarises the sources column
+# by column into a JSON-serialisable profile; generate_chunks() draws any number of rows from a
+# profile. Output is deterministic for a given seed and chunk size.
+#
+# Only CATEGORICAL_COLUMNS, low-cardinality codes and flags, are drawn from their observed
+# frequencies, and JOINT_COLUMNS from observed combinations, so visa counts stay consistent
+# with each other and status with the expiry date; their dates are shifted by a random number
+# of days. Every other column is synthesised rather than copied: PATTERN_COLUMNS keep the
+# shape of their values (phone prefixes, digit counts) with fresh digits, also inside a joint
+# group, NAME_COLUMNS recombine words seen in names, emails and URLs keep the share of public
+# domains and the top-level domains, free text becomes random words, and timestamps are drawn
+# between the observed first and last. Columns in none of these lists (addresses, lookup
+# results and anything added to the sources later) are left empty, so no production value
+# reaches a profile unless it is listed here.
+
+SOURCES = ['./data/appro-companies.xlsx', './data/3k_extended.csv']
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+JOINT_COLUMNS = [
+    ['status', 'est_date', 'expiry_date', 'expiry_date_in_date_format'],
+    ['visa_allocation_quota', 'visa_approved', 'visa_cancelled', 'visa_requested', 'visa_used'],
+    ['economic_department', 'registration_ed_branch', 'city'],
+    ['phone_no', 'mobile_no']
+]
+
+# Largest shift, in days either way, applied to the dates of a joint combination
+DATE_JITTER_DAYS = 60
+
+# Column -> leading characters kept as observed; the remaining digits are redrawn
+PATTERN_COLUMNS = {'phone_no': 5, 'mobile_no': 5, 'bl_local_no': 1, 'cbls_no': 1, 'po_box': 0, 'zgis_po_box': 0}
+
+CATEGORICAL_COLUMNS = ['created_by', 'modified_by', 'city', 'domain_presence_score', 'domain_vintage',
+                       'economic_department', 'elastic_search_sync_status', 'integration_gmap_flag',
+                       'integration_gsearch_flag', 'integration_wayback_flag', 'integration_zgis_flag',
+                       'is_already_updated_place', 'is_already_updated_wayback_archive', 'is_branch', 'legal_type',
+                       'nationality', 'registration_ed_branch', 'status', 'wps']
+
+NAME_COLUMNS = ['business_name_english', 'business_name_arabic']
+SEQUENCE_COLUMNS = ['company_id']
+UUID_COLUMNS = ['id']
+EMAIL_COLUMNS = ['email']
+URL_COLUMNS = ['website', 'website_url', 'website_address', 'gsearch_website_url', 'gmap_website_url',
+               'zgis_website_url']
+TEXT_COLUMNS = ['ba_desc_arabic', 'ba_desc_english']
+TIMESTAMP_COLUMNS = ['created_date', 'modified_date', 'gmap_trigger_date', 'gsearch_trigger_date',
+                     'wayback_trigger_date', 'zgis_trigger_date']
+
+_LETTERS = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+
+def _frequencies(values):
+    # Distinct values (None for missing) and their shares, as plain Python values for JSON
+    counts = values.value_counts(dropna=False, normalize=True)
+    return [None if pd.isna(value) else _plain(value) for value in counts.index], counts.tolist()
+
+
+def _plain(value):
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _digits_text(values):
+    # Observed values as text, integral floats (Excel phone numbers) without their '.0'
+    if pd.api.types.is_numeric_dtype(values):
+        return values.dropna().map(lambda value: f"{value:.0f}")
+    return values.dropna().astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+
+
+def _templates(values, keep):
+    # Values with every digit after the first keep characters replaced by '#'; missing stay missing
+    text = _digits_text(values)
+    return (text.str[:keep] + text.str[keep:].str.replace(r'\d', '#', regex=True)).reindex(values.index)
+
+
+def _learn_joint(df, columns):
+    combinations = df[columns].astype(object).where(df[columns].notna(), None)
+    pattern_columns = [column for column in columns if column in PATTERN_COLUMNS]
+    for column in pattern_columns:
+        combinations[column] = _templates(df[column], PATTERN_COLUMNS[column])
+    combinations = combinations.map(_plain).apply(tuple, axis=1)
+    rows, weights = _frequencies(combinations)
+    return {'kind': 'joint', 'columns': columns, 'rows': [list(row) for row in rows], 'weights': weights,
+            'date_columns': [column for column in columns if column in DATE_FORMATS],
+            'pattern_columns': pattern_columns}
+
+
+def _learn_pattern(values, keep):
+    templates, weights = _frequencies(_templates(values, keep).dropna())
+    return {'kind': 'pattern', 'templates': templates, 'weights': weights, 'missing': float(values.isna().mean())}
+
+
+def _learn_name(values):
+    words = values.dropna().astype(str).str.split()
+    tokens, token_weights = _frequencies(words.explode().dropna())
+    lengths, length_weights = _frequencies(words.str.len())
+    return {'kind': 'name', 'tokens': tokens, 'token_weights': token_weights, 'lengths': lengths,
+            'length_weights': length_weights, 'missing': float(values.isna().mean())}
+
+
+def _learn_email(values):
+    present = values.dropna().astype(str)
+    domains = email_domain(present)
+    public = domains[domains.isin(PUBLIC_EMAIL_DOMAINS)]
+    company = domains[(domains != '') & ~domains.isin(PUBLIC_EMAIL_DOMAINS)]
+    public_domains, public_weights = _frequencies(public) if len(public) else ([], [])
+    tlds, tld_weights = _frequencies(company.str.rpartition('.')[2]) if len(company) else ([], [])
+    return {'kind': 'email', 'missing': float(values.isna().mean()),
+            'public_share': len(public) / max(len(present), 1), 'invalid_share': float((domains == '').mean()),
+            'public_domains': public_domains, 'public_weights': public_weights,
+            'tlds': tlds, 'tld_weights': tld_weights}
+
+
+def _learn_url(values):
+    present = values.dropna().astype(str)
+    tlds, tld_weights = _frequencies(present.str.rpartition('.')[2])
+    return {'kind': 'url', 'missing': float(values.isna().mean()), 'tlds': tlds, 'tld_weights': tld_weights}
+
+
+def _learn_text(values):
+    lengths, length_weights = _frequencies(values.dropna().astype(str).str.split().str.len())
+    return {'kind': 'text', 'missing': float(values.isna().mean()), 'lengths': lengths,
+            'length_weights': length_weights}
+
+
+def _learn_timestamp(values):
+    timestamps = pd.to_datetime(values, errors='coerce')
+    return {'kind': 'timestamp', 'missing': float(timestamps.isna().mean()), 'first': timestamps.min().isoformat(),
+            'last': timestamps.max().isoformat()}
+
+
+def learn_profile(paths=SOURCES):
+    df = pd.concat([read_source(path) for path in paths], ignore_index=True)
+    columns = {}
+    for group in JOINT_COLUMNS:
+        present = [column for column in group if column in df.columns]
+        if present:
+            joint = _learn_joint(df, present)
+            for column in present:
+                columns[column] = joint
+
+    for column in df.columns:
+        if column in columns:
+            continue
+        values = df[column]
+        if values.isna().all():
+            spec = {'kind': 'empty'}
+        elif column in PATTERN_COLUMNS:
+            spec = _learn_pattern(values, PATTERN_COLUMNS[column])
+        elif column in NAME_COLUMNS:
+            spec = _learn_name(values)
+        elif column in EMAIL_COLUMNS:
+            spec = _learn_email(values)
+        elif column in SEQUENCE_COLUMNS:
+            spec = {'kind': 'sequence', 'missing': float(values.isna().mean())}
+        elif column in UUID_COLUMNS:
+            spec = {'kind': 'uuid'}
+        elif column in URL_COLUMNS:
+            spec = _learn_url(values)
+        elif column in TEXT_COLUMNS:
+            spec = _learn_text(values)
+        elif column in TIMESTAMP_COLUMNS and pd.to_datetime(values, errors='coerce').notna().any():
+            spec = _learn_timestamp(values)
+        elif column in CATEGORICAL_COLUMNS:
+            observed, weights = _frequencies(values)
+            spec = {'kind': 'categorical', 'values': observed, 'weights': weights}
+        else:
+            spec = {'kind': 'empty'}
+        spec['numeric'] = bool(pd.api.types.is_numeric_dtype(values))
+        columns[column] = spec
+
+    return {'rows': len(df), 'column_order': list(df.columns), 'columns': columns}
+
+
+def save_profile(profile, path):
+    with open(path, 'w') as f:
+        json.dump(profile, f)
+
+
+def load_profile(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _choice(rng, values, weights, size):
+    values = np.array(values + [None], dtype=object)[:-1]
+    weights = np.asarray(weights, dtype=float)
+    return values[rng.choice(len(values), size=size, p=weights / weights.sum())]
+
+
+def _with_missing(rng, values, missing):
+    values = np.asarray(values, dtype=object)
+    values[rng.random(len(values)) < missing] = None
+    return values
+
+
+def _fill_digits(rng, templates):
+    # Each '#' of each template replaced by a random digit
+    filled = np.empty(len(templates), dtype=object)
+    for template in pd.unique(templates):
+        rows = np.flatnonzero(templates == template)
+        chars = np.tile(np.array(list(template)), (len(rows), 1))
+        slots = np.flatnonzero(chars[0] == '#')
+        chars[:, slots] = rng.integers(0, 10, size=(len(rows), len(slots))).astype(str)
+        filled[rows] = chars.view(f'<U{len(template)}').ravel().astype(object)
+    return filled
+
+
+def _random_words(rng, size, low=5, high=10):
+    lengths = rng.integers(low, high + 1, size=size)
+    letters = _LETTERS[rng.integers(0, len(_LETTERS), size=(size, high))]
+    return np.array([''.join(row[:length]) for row, length in zip(letters, lengths)], dtype=object)
+
+
+def _generate_joint(rng, spec, size):
+    rows = pd.DataFrame(_choice(rng, spec['rows'], spec['weights'], size).tolist(), columns=spec['columns'])
+    shift = pd.to_timedelta(rng.integers(-DATE_JITTER_DAYS, DATE_JITTER_DAYS + 1, size=size), unit='D')
+    for column in spec['date_columns']:
+        dates = pd.to_datetime(rows[column]) + shift
+        rows[column] = dates.dt.strftime(DATE_FORMATS[column]).where(dates.notna(), None)
+    for column in spec['pattern_columns']:
+        templates = rows[column].to_numpy(dtype=object)
+        present = pd.notna(templates)
+        templates[present] = _fill_digits(rng, templates[present])
+        rows[column] = templates
+    return {column: rows[column].to_numpy(dtype=object) for column in spec['columns']}
+
+
+def _generate_name(rng, spec, size):
+    lengths = _choice(rng, spec['lengths'], spec['length_weights'], size).astype(int)
+    tokens = _choice(rng, spec['tokens'], spec['token_weights'], int(lengths.sum()))
+    names = [' '.join(words) for words in np.split(tokens, np.cumsum(lengths)[:-1])]
+    return _with_missing(rng, names, spec['missing'])
+
+
+def _generate_email(rng, spec, size):
+    local = _random_words(rng, size)
+    emails = local.copy()
+    kind = rng.random(size)
+    public = kind < spec['public_share']
+    invalid = ~public & (kind < spec['public_share'] + spec['invalid_share'])
+    company = ~public & ~invalid
+    if public.any() and spec['public_domains']:
+        emails[public] = local[public] + '@' + _choice(rng, spec['public_domains'], spec['public_weights'],
+                                                       int(public.sum()))
+    if company.any() and spec['tlds']:
+        emails[company] = (local[company] + '@' + _random_words(rng, int(company.sum())) + '.' +
+                           _choice(rng, spec['tlds'], spec['tld_weights'], int(company.sum())))
+    return _with_missing(rng, emails, spec['missing'])
+
+
+def _generate_timestamp(rng, spec, size):
+    first, last = pd.Timestamp(spec['first']), pd.Timestamp(spec['last'])
+    offsets = rng.integers(0, (last - first).value + 1, size=size)
+    timestamps = (first + pd.to_timedelta(offsets, unit='ns')).map(pd.Timestamp.isoformat)
+    return _with_missing(rng, timestamps, spec['missing'])
+
+
+def _generate_column(rng, spec, size, start):
+    kind = spec['kind']
+    if kind == 'empty':
+        return np.full(size, None, dtype=object)
+    if kind == 'categorical':
+        return _choice(rng, spec['values'], spec['weights'], size)
+    if kind == 'pattern':
+        templates = _choice(rng, spec['templates'], spec['weights'], size)
+        return _with_missing(rng, _fill_digits(rng, templates), spec['missing'])
+    if kind == 'name':
+        return _generate_name(rng, spec, size)
+    if kind == 'email':
+        return _generate_email(rng, spec, size)
+    if kind == 'url':
+        urls = _random_words(rng, size) + '.' + _choice(rng, spec['tlds'], spec['tld_weights'], size)
+        return _with_missing(rng, urls, spec['missing'])
+    if kind == 'text':
+        lengths = _choice(rng, spec['lengths'], spec['length_weights'], size).astype(int)
+        words = _random_words(rng, int(lengths.sum()))
+        text = [' '.join(row) for row in np.split(words, np.cumsum(lengths)[:-1])]
+        return _with_missing(rng, text, spec['missing'])
+    if kind == 'timestamp':
+        return _generate_timestamp(rng, spec, size)
+    if kind == 'sequence':
+        return _with_missing(rng, np.arange(start + 1, start + size + 1), spec['missing'])
+    if kind == 'uuid':
+        return np.array([str(uuid.UUID(bytes=value.tobytes(), version=4))
+                         for value in rng.integers(0, 256, size=(size, 16), dtype=np.uint8)], dtype=object)
+    raise ValueError(f"Unknown column kind '{kind}'")
+
+
+def generate_chunk(profile, size, seed=0, start=0):
+    # size synthetic rows; start is the position of the first one in the whole dataset
+    rng = np.random.default_rng([seed, start])
+    columns = {}
+    for column in profile['column_order']:
+        if column in columns:
+            continue
+        spec = profile['columns'][column]
+        if spec['kind'] == 'joint':
+            columns.update(_generate_joint(rng, spec, size))
+        else:
+            columns[column] = _generate_column(rng, spec, size, start)
+
+    chunk = pd.DataFrame(columns, index=pd.RangeIndex(start, start + size))[profile['column_order']]
+    for column in profile['column_order']:
+        if profile['columns'][column].get('numeric'):
+            chunk[column] = pd.to_numeric(chunk[column]).astype(float)
+        else:
+            chunk[column] = chunk[column].astype(object).where(chunk[column].notna(), None)
+            chunk[column] = chunk[column].map(lambda value: value if value is None else str(value))
+    return chunk
+
+
+def generate_chunks(profile, n_rows, seed=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    for start in range(0, n_rows, chunk_size):
+        yield generate_chunk(profile, min(chunk_size, n_rows - start), seed, start)
+
+
+def write_registry(profile, path, n_rows, seed=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Writes n_rows synthetic rows to a .csv or .parquet file, one chunk at a time
+    tmp_path = f"{path}.tmp"
+    if path.lower().endswith(('.parquet', '.pq')):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([pa.field(column, pa.float64() if profile['columns'][column].get('numeric')
+                                     else pa.string()) for column in profile['column_order']])
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for chunk in generate_chunks(profile, n_rows, seed, chunk_size):
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    else:
+        for chunk in generate_chunks(profile, n_rows, seed, chunk_size):
+            chunk.to_csv(tmp_path, mode='w' if chunk.index[0] == 0 else 'a', header=chunk.index[0] == 0,
+                         index=False)
+    os.replace(tmp_path, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic registry shaped like the real sources.")
+    parser.add_argument('-n', '--rows', type=int, default=1_000_000, help="Rows to generate (default: 1000000)")
+    parser.add_argument('-o', '--output', default='./data/synthetic_registry.parquet',
+                        help="Output .csv or .parquet file (default: ./data/synthetic_registry.parquet)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Rows generated and written at a time (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--sources', nargs='+', default=SOURCES, help="Registry files to learn distributions from")
+    parser.add_argument('--profile', help="Generate from a saved profile instead of learning from the sources")
+    parser.add_argument('--save-profile', help="Also save the learned profile as JSON, to generate without the sources")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = load_profile(args.profile) if args.profile else learn_profile(args.sources)
+    if args.save_profile:
+        save_profile(profile, args.save_profile)
+        print(f"Profile saved to '{args.save_profile}'")
+    write_registry(profile, args.output, args.rows, args.seed, args.chunk_size)
+    print(f"{args.rows} synthetic rows saved to '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()